@@ -1,25 +1,26 @@
 ## affiliate_converter.py
 
 import logging
-import re
-from aliexpress_api import AliexpressApi, models
-from dotenv import load_dotenv
-import os
+from cache import affiliate_cache
+from clients import get_aliexpress_client
+from config import AFFILIATE_BATCH_SIZE, ALIEXPRESS_TRACKING_ID
+from logging_setup import log_payload
+from metrics import count_api_call
+from link_parser import parse_links, is_convertible, replace_links, normalize_url
 
-logging.basicConfig(level=logging.DEBUG)
-
-load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
-ALIEXPRESS_KEY = os.getenv('ALIEXPRESS_KEY')
-ALIEXPRESS_SECRET = os.getenv('ALIEXPRESS_SECRET')
-ALIEXPRESS_TRACKING_ID = os.getenv('ALIEXPRESS_TRACKING_ID')
-
-aliexpress = AliexpressApi(ALIEXPRESS_KEY, ALIEXPRESS_SECRET, models.Language.EN, models.Currency.USD, ALIEXPRESS_TRACKING_ID)
+logger = logging.getLogger(__name__)
 
 def generate_affiliate_link(source_url):
+    cache_key = normalize_url(source_url)
+    cached = affiliate_cache.get(cache_key)
+    if cached:
+        logger.debug("Affiliate cache hit for URL: %s", source_url)
+        return cached
     try:
-        logging.debug(f"Generating affiliate link for URL: {source_url}")
-        response = aliexpress.get_affiliate_links(source_url, tracking_id=ALIEXPRESS_TRACKING_ID)
-        logging.debug(f"API Response: {response}")
+        logger.debug("Generating affiliate link for URL: %s", source_url)
+        count_api_call('get_affiliate_links')
+        response = get_aliexpress_client().get_affiliate_links(source_url, tracking_id=ALIEXPRESS_TRACKING_ID)
+        log_payload(logger, "API Response", response)
 
         affiliate_link = None
         if isinstance(response, list):
@@ -28,27 +29,70 @@ def generate_affiliate_link(source_url):
                     affiliate_link = link_info.promotion_link
                     break
         if affiliate_link:
-            logging.debug(f"Generated affiliate link: {affiliate_link}")
+            logger.debug("Generated affiliate link: %s", affiliate_link)
+            affiliate_cache.set(cache_key, affiliate_link)
             return affiliate_link
         else:
-            logging.warning("No affiliate links found.")
+            logger.warning("No affiliate links found.")
             return None
     except Exception as e:
-        logging.error(f"Request failed: {e}")
+        logger.error("Request failed: %s", e)
         return None
 
-def is_aliexpress_affiliate_link(url, tracking_id):
-    return any(part in url for part in [tracking_id, 's.click.aliexpress.com'])
-
-def convert_affiliate_links(content):
-    url_pattern = re.compile(r'https?://[^\s]+')
-    urls = url_pattern.findall(content)
-
-    for url in urls:
-        if "aliexpress.com" in url:
-            if not is_aliexpress_affiliate_link(url, ALIEXPRESS_TRACKING_ID):
-                affiliate_url = generate_affiliate_link(url)
-                if affiliate_url:
-                    content = content.replace(url, affiliate_url)
-    
-    return content
+def generate_affiliate_links(source_urls):
+    links = {}
+    pending = {}
+    for url in dict.fromkeys(source_urls):
+        cache_key = normalize_url(url)
+        cached = affiliate_cache.get(cache_key)
+        if cached:
+            links[url] = cached
+        elif ',' in url:
+            # The API takes a comma-separated list, so these can't share a call
+            affiliate_link = generate_affiliate_link(url)
+            if affiliate_link:
+                links[url] = affiliate_link
+        else:
+            pending.setdefault(cache_key, []).append(url)
+
+    cache_keys = list(pending)
+    for start in range(0, len(cache_keys), AFFILIATE_BATCH_SIZE):
+        chunk = cache_keys[start:start + AFFILIATE_BATCH_SIZE]
+        try:
+            logger.debug("Generating affiliate links for %s URLs", len(chunk))
+            count_api_call('get_affiliate_links')
+            response = get_aliexpress_client().get_affiliate_links(','.join(chunk), tracking_id=ALIEXPRESS_TRACKING_ID)
+            log_payload(logger, "API Response", response)
+        except Exception as e:
+            logger.error("Batch request failed: %s", e)
+            continue
+
+        response = [link_info for link_info in response or [] if getattr(link_info, 'promotion_link', None)]
+        converted = {}
+        for link_info in response:
+            source_value = getattr(link_info, 'source_value', None)
+            if source_value:
+                converted[normalize_url(source_value)] = link_info.promotion_link
+        # Fall back to response order when the API doesn't echo the source URLs back
+        if not converted and len(response) == len(chunk):
+            converted = {cache_key: link_info.promotion_link for cache_key, link_info in zip(chunk, response)}
+
+        for cache_key in chunk:
+            affiliate_link = converted.get(cache_key)
+            if not affiliate_link:
+                logger.warning("No affiliate link returned for URL: %s", cache_key)
+                continue
+            affiliate_cache.set(cache_key, affiliate_link)
+            for url in pending[cache_key]:
+                links[url] = affiliate_link
+    return links
+
+def convert_affiliate_links_with_map(content, links=None):
+    if links is None:
+        links = parse_links(content, ALIEXPRESS_TRACKING_ID)
+    urls = [link.url for link in links if is_convertible(link)]
+    if not urls:
+        return content, {}
+
+    affiliate_links = generate_affiliate_links(urls)
+    return replace_links(content, links, affiliate_links), affiliate_links
@@ -1,68 +1,87 @@
 ## aliexpress_scraper.py
 
 import logging
-import re
-import requests
-from aliexpress_api import AliexpressApi, models
-from dotenv import load_dotenv
-import os
+from urllib.parse import urljoin, unquote
+from config import HTTP_TIMEOUT, MAX_REDIRECTS
+from cache import product_cache, short_link_cache
+from clients import get_aliexpress_client, get_http_session
+from logging_setup import log_payload
+from metrics import count_api_call, timed
+from link_parser import ITEM_URL_PATTERN, extract_product_id
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
-
-# Load environment variables from .env file
-load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
-ALIEXPRESS_KEY = os.getenv('ALIEXPRESS_KEY')
-ALIEXPRESS_SECRET = os.getenv('ALIEXPRESS_SECRET')
-ALIEXPRESS_TRACKING_ID = os.getenv('ALIEXPRESS_TRACKING_ID')
-
-# Initialize the AliExpress API with your credentials
-aliexpress = AliexpressApi(ALIEXPRESS_KEY, ALIEXPRESS_SECRET, models.Language.EN, models.Currency.USD, ALIEXPRESS_TRACKING_ID)
+logger = logging.getLogger(__name__)
 
 def resolve_shortened_url(url):
+    # Follow redirects by hand so we can stop as soon as an item page shows up in the chain
+    current_url = url
     try:
-        response = requests.head(url, allow_redirects=True)
-        resolved_url = response.url
-        logging.debug(f"Resolved URL: {resolved_url}")
-        return resolved_url
+        for _ in range(MAX_REDIRECTS + 1):
+            unquoted_url = unquote(current_url)
+            if ITEM_URL_PATTERN.search(unquoted_url):
+                logger.debug("Resolved URL: %s", unquoted_url)
+                return unquoted_url
+
+            count_api_call('resolve_shortened_url')
+            response = get_http_session().head(current_url, allow_redirects=False, timeout=HTTP_TIMEOUT)
+            location = response.headers.get('Location')
+            if not response.is_redirect or not location:
+                logger.debug("Resolved URL: %s", current_url)
+                return current_url
+            current_url = urljoin(current_url, location)
+
+        logger.warning("Gave up resolving %s after %s redirects", url, MAX_REDIRECTS)
+        return current_url
     except Exception as e:
-        logging.error(f"Failed to resolve shortened URL: {e}")
+        logger.error("Failed to resolve shortened URL: %s", e)
         return None
 
 def get_product_id(url):
-    match = re.search(r'/item/(\d+).html', url)
-    if not match:
-        match = re.search(r'/(\d+)\.html', url)
-    if match:
-        product_id = match.group(1)
-        logging.debug(f"Extracted Product ID: {product_id}")
+    product_id = extract_product_id(url)
+    if product_id:
+        logger.debug("Extracted Product ID: %s", product_id)
         return product_id
     else:
-        logging.warning("No product ID found in the URL.")
+        logger.warning("No product ID found in the URL.")
         return None
 
-def get_product_details(product_id):
+def _product_info_to_dict(product_info):
+    return {
+        'product_id': product_info.product_id,
+        'product_title': product_info.product_title,
+        'small_image_urls': list(product_info.product_small_image_urls or []),
+        'promotion_link': product_info.promotion_link,
+    }
+
+def get_products_details_batch(product_ids):
+    results = {}
+    product_ids = list(dict.fromkeys(str(product_id) for product_id in product_ids))
+    if not product_ids:
+        return results
     try:
-        logging.debug(f"Fetching details for Product ID: {product_id}")
-        response = aliexpress.get_products_details([product_id])
-        logging.debug(f"API Response: {response}")
-        return response
+        logger.debug("Fetching details for %s Product IDs: %s", len(product_ids), product_ids)
+        count_api_call('get_products_details')
+        response = get_aliexpress_client().get_products_details(product_ids)
+        log_payload(logger, "API Response", response)
     except Exception as e:
-        logging.error(f"Request failed: {e}")
-        return None
+        logger.error("Batch request failed: %s", e)
+        return results
+    for product_info in response or []:
+        details = _product_info_to_dict(product_info)
+        product_id = str(product_info.product_id)
+        product_cache.set(product_id, details)
+        results[product_id] = details
+    return results
 
-def fetch_aliexpress_product_details(url):
-    resolved_url = resolve_shortened_url(url)
+def resolve_product_id(url):
+    url = url.strip()
+    cached = short_link_cache.get(url)
+    if cached:
+        return cached
+    with timed('resolve'):
+        resolved_url = resolve_shortened_url(url)
     if resolved_url:
         product_id = get_product_id(resolved_url)
         if product_id:
-            product_details = get_product_details(product_id)
-            if product_details:
-                product_info = product_details[0]
-                return {
-                    'product_id': product_info.product_id,
-                    'product_title': product_info.product_title,
-                    'small_image_urls': product_info.product_small_image_urls,
-                    'promotion_link': product_info.promotion_link,
-                }
+            short_link_cache.set(url, product_id)
+        return product_id
     return None
@@ -0,0 +1,712 @@
+## benchmark.py
+#
+# Drives the real handlers (forward -> Publish -> Yes) against local stand-ins
+# for the Telegram Bot API, the AliExpress API, GitHub and short-link
+# redirects, each with configurable latency, and reports per-update p50/p99
+# latency and updates per second, e.g.
+#   python benchmark.py --promos 200 --concurrency 20 --telegram-latency 40
+#   python benchmark.py --save baseline.json
+#   python benchmark.py --compare baseline.json
+#   python benchmark.py --replay recorded-updates.jsonl
+#
+# Promos in one chat run one after another, as an admin would click through
+# them; different chats run concurrently.
+#
+# Other scenarios measure one part of the bot against the same stand-ins:
+#   python benchmark.py --scenario inflight --in-flight 50
+#   python benchmark.py --scenario feed --feed-size 10000
+#   python benchmark.py --scenario images --product-images 10
+
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+BOT_TOKEN = '123456:benchmark'
+REPOSITORY = 'bench/feed'
+UPDATE_TYPES = ('forward', 'publish', 'confirm_publish')
+
+def _sample_jpeg():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (1600, 1200), (200, 90, 40)).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+# One local server plays three parts: the Bot API (/bot<token>/<method> and
+# /file/bot<token>/<path>), GitHub's Git Data API (/repos/...) and a link
+# shortener (/e/<id> redirects to an item page)
+class FakeServices:
+    def __init__(self, telegram_latency, github_latency, redirect_latency):
+        self.telegram_latency = telegram_latency
+        self.github_latency = github_latency
+        self.redirect_latency = redirect_latency
+        self.image = _sample_jpeg()
+        self.calls = {}
+        self.markups = {}
+        self.github_commits = 0
+        self.github_bytes = 0
+        self._message_ids = itertools.count(1_000_000)
+        self._shas = itertools.count(1)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-services', daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+    def last_markup(self, chat_id):
+        return self.markups.get(chat_id)
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _sha(self):
+        return f"{next(self._shas):040x}"
+
+    def _message(self, chat_id, params):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        if params.get('text'):
+            message['text'] = params['text']
+        if params.get('caption'):
+            message['caption'] = params['caption']
+        if params.get('photo'):
+            message['photo'] = [{"file_id": params['photo'], "file_unique_id": params['photo'][-16:], "width": 800, "height": 600}]
+        if params.get('reply_markup'):
+            markup = json.loads(params['reply_markup'])
+            message['reply_markup'] = markup
+            self.markups[chat_id] = markup
+        return message
+
+    def telegram(self, method, params):
+        self._count(method)
+        time.sleep(self.telegram_latency)
+        chat_id = int(params['chat_id']) if 'chat_id' in params else None
+        if method == 'getMe':
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == 'getFile':
+            return {"file_id": params['file_id'], "file_unique_id": params['file_id'][-16:],
+                    "file_size": len(self.image), "file_path": f"photos/{params['file_id']}.jpg"}
+        if method in ('sendMessage', 'sendPhoto'):
+            return self._message(chat_id, params)
+        if method == 'sendMediaGroup':
+            return [self._message(chat_id, {'photo': item['media']}) for item in json.loads(params['media'])]
+        if method in ('editMessageReplyMarkup', 'editMessageMedia', 'editMessageCaption'):
+            return self._message(chat_id, params)
+        return True
+
+    def github(self, method, path, body):
+        self._count(f"github {method}")
+        time.sleep(self.github_latency)
+        if path.endswith('/blobs'):
+            with self._lock:
+                self.github_bytes += len(body)
+        if method == 'PATCH':
+            with self._lock:
+                self.github_commits += 1
+            return {}
+        if '/git/ref/' in path:
+            return {"object": {"sha": self._sha()}}
+        if method == 'GET':
+            return {"tree": {"sha": self._sha()}}
+        return {"sha": self._sha()}
+
+    def _make_handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # Headers and body go out in separate writes; without this, Nagle plus
+                # delayed ACKs add ~40ms to every keep-alive response
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def _body(self):
+                if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                    chunks = []
+                    while True:
+                        size = int(self.rfile.readline().split(b';')[0], 16)
+                        chunk = self.rfile.read(size)
+                        self.rfile.readline()
+                        if not size:
+                            return b''.join(chunks)
+                        chunks.append(chunk)
+                return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+            def _params(self, body):
+                content_type = self.headers.get('Content-Type', '')
+                if content_type.startswith('application/json'):
+                    return json.loads(body or b'{}')
+                return {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+
+            def _send(self, status, body=b'', content_type='application/json', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _json(self, payload):
+                self._send(200, json.dumps(payload).encode('utf-8'))
+
+            def _dispatch(self):
+                path = urlsplit(self.path).path
+                body = self._body()
+                if path.startswith('/file/'):
+                    services._count('file download')
+                    time.sleep(services.telegram_latency)
+                    self._send(200, services.image, 'image/jpeg')
+                elif path.startswith('/bot'):
+                    method = path.rsplit('/', 1)[1]
+                    self._json({"ok": True, "result": services.telegram(method, self._params(body))})
+                elif path.startswith('/repos/'):
+                    self._json(services.github(self.command, path, body))
+                elif path.startswith('/e/'):
+                    services._count('short link')
+                    time.sleep(services.redirect_latency)
+                    product_id = path.rsplit('_', 1)[1]
+                    self._send(302, headers={'Location': f"https://www.aliexpress.com/item/{product_id}.html"})
+                else:
+                    self._send(404)
+
+            do_GET = do_POST = do_PATCH = do_HEAD = _dispatch
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+# Stands in for aliexpress_api.AliexpressApi with the two calls the bot makes
+class FakeAliexpressApi:
+    def __init__(self, latency, images=5):
+        self.latency = latency
+        self.images = images
+        self.calls = 0
+
+    def get_products_details(self, product_ids):
+        self.calls += 1
+        time.sleep(self.latency)
+        return [SimpleNamespace(
+            product_id=product_id,
+            product_title=f"Benchmark product {product_id} wireless earbuds",
+            product_small_image_urls=[f"https://ae01.alicdn.com/kf/S{product_id}{n}.jpg" for n in range(self.images)],
+            target_sale_price='9.99',
+            target_original_price='19.99',
+            promotion_link=f"https://s.click.aliexpress.com/e/_p{product_id}",
+        ) for product_id in product_ids]
+
+    def get_affiliate_links(self, links, tracking_id=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        return [SimpleNamespace(source_value=link, promotion_link=f"https://s.click.aliexpress.com/e/_a{abs(hash(link)) % 10**8}")
+                for link in links.split(',')]
+
+def _user(chat_id):
+    return {"id": chat_id, "is_bot": False, "first_name": "Admin"}
+
+def forward_update(update_id, message_id, chat_id, text, photo=None):
+    now = int(time.time())
+    message = {
+        "message_id": message_id,
+        "date": now,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": _user(chat_id),
+        "forward_origin": {"type": "user", "date": now, "sender_user": {"id": 777, "is_bot": False, "first_name": "Shop"}},
+    }
+    if photo:
+        message['photo'] = [{"file_id": photo, "file_unique_id": photo[-16:], "width": 1600, "height": 1200}]
+        message['caption'] = text
+    else:
+        message['text'] = text
+    return {"update_id": update_id, "message": message}
+
+def callback_update(update_id, chat_id, data, markup=None):
+    message = {"message_id": update_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "text": "draft"}
+    if markup:
+        message['reply_markup'] = markup
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(chat_id),
+            "chat_instance": "benchmark",
+            "data": data,
+            "message": message,
+        },
+    }
+
+def synthetic_promos(count, products, photo_ratio, short_link_ratio, chats, services_url):
+    promos = []
+    photo_every = round(1 / photo_ratio) if photo_ratio else 0
+    short_every = round(1 / short_link_ratio) if short_link_ratio else 0
+    for index in range(count):
+        product_id = 1005006000000000 + index % products
+        if short_every and index % short_every == 0:
+            # The only link, so the handler has to resolve it
+            text = f"Deal of the day #{index}: wireless earbuds for $9.99 (-50%)\n{services_url}/e/_{product_id}"
+        else:
+            text = (f"Deal of the day #{index}: wireless earbuds for $9.99 (-50%)\n"
+                    f"https://www.aliexpress.com/item/{product_id}.html?spm=a2g0o.deal.{index}\n"
+                    f"More deals: https://www.aliexpress.com/item/{product_id + 1}.html")
+        photo = f"AgACAgQAAxkBAAIBench{index:08d}" if photo_every and index % photo_every == 0 else None
+        chat_id = 10_000 + index % chats
+        promos.append(forward_update(0, 0, chat_id, text, photo))
+    return promos
+
+def load_replay(path):
+    promos = []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                update = json.loads(line)
+                if (update.get('message') or {}).get('forward_origin') or (update.get('message') or {}).get('forward_date'):
+                    promos.append(update)
+    return promos
+
+def _button_data(markup, label):
+    for row in (markup or {}).get('inline_keyboard', []):
+        for button in row:
+            if button.get('text') == label:
+                return button.get('callback_data')
+    return None
+
+def configure_environment(args, services):
+    # Everything the bot imports reads config at import, so this runs first
+    workdir = tempfile.mkdtemp(prefix='promo-bench-')
+    os.chdir(workdir)
+    os.environ.update({
+        'TELEGRAM_API_TOKEN': BOT_TOKEN,
+        'TELEGRAM_API_BASE_URL': f"{services.url}/bot",
+        'TELEGRAM_API_BASE_FILE_URL': f"{services.url}/file/bot",
+        'GITHUB_API_URL': services.url,
+        'GITHUB_REPOSITORY': REPOSITORY,
+        'GIT_TOKEN': 'benchmark',
+        'GITHUB_SYNC_DEBOUNCE': str(args.github_debounce),
+        'CACHE_DIR': workdir,
+        'DRAFT_STORE_BACKEND': 'memory',
+        'PUBLISH_SLOT_MINUTES': '0',
+        # Repeated products are the point of --products; with --dedupe they are skipped instead
+        'DEDUPE_WINDOW': str(24 * 60 * 60) if args.dedupe else '0',
+        'METRICS_ENABLED': 'true',
+        'METRICS_PORT': '0',
+    })
+    if not args.rate_limits:
+        # Measure the bot, not the flood-control budget
+        os.environ.update({'SEND_GLOBAL_RATE': '100000', 'SEND_CHAT_RATE': '100000', 'SEND_CHAT_BURST': '100000'})
+
+async def process_update(application, payload):
+    from telegram import Update
+    update = Update.de_json(payload, application.bot)
+    started = time.perf_counter()
+    await application.process_update(update)
+    return time.perf_counter() - started
+
+def latency_summary(values):
+    return {
+        'count': len(values),
+        'p50': round(_percentile(values, 0.5) * 1000, 2) if values else None,
+        'p99': round(_percentile(values, 0.99) * 1000, 2) if values else None,
+        'mean': round(statistics.fmean(values) * 1000, 2) if values else None,
+    }
+
+async def run_flow(args, application, services):
+    from github_sync import github_sync
+
+    promos = load_replay(args.replay) if args.replay else synthetic_promos(
+        args.promos, args.products or args.promos, args.photo_ratio, args.short_link_ratio, args.chats, services.url)
+    by_chat = {}
+    for promo in promos:
+        by_chat.setdefault(promo['message']['chat']['id'], []).append(promo)
+
+    latencies = {update_type: [] for update_type in UPDATE_TYPES}
+    failures = []
+    duplicates = []
+    update_ids = itertools.count(1)
+    message_ids = itertools.count(1)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def process(update_type, payload):
+        latencies[update_type].append(await process_update(application, payload))
+
+    async def click(chat_id, label, update_type):
+        data = _button_data(services.last_markup(chat_id), label)
+        if data is None:
+            failures.append(f"chat {chat_id}: no '{label}' button")
+            return False
+        await process(update_type, callback_update(next(update_ids), chat_id, data))
+        return True
+
+    async def run_chat(chat_id, chat_promos):
+        async with semaphore:
+            for promo in chat_promos:
+                promo = json.loads(json.dumps(promo))
+                promo['update_id'] = next(update_ids)
+                if not args.replay:
+                    promo['message']['message_id'] = next(message_ids)
+                services.markups.pop(chat_id, None)
+                await process('forward', promo)
+                if args.dedupe and services.last_markup(chat_id) is None:
+                    duplicates.append(promo['update_id'])
+                    continue
+                if await click(chat_id, 'Publish', 'publish'):
+                    await click(chat_id, 'Yes', 'confirm_publish')
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_chat(chat_id, chat_promos) for chat_id, chat_promos in by_chat.items()))
+    elapsed = time.perf_counter() - started
+
+    flush_started = time.perf_counter()
+    await github_sync.flush()
+    flush_elapsed = time.perf_counter() - flush_started
+
+    updates = sum(len(values) for values in latencies.values())
+    return {
+        'promos': len(promos),
+        'updates': updates,
+        'elapsed_s': round(elapsed, 3),
+        'updates_per_s': round(updates / elapsed, 1) if elapsed else None,
+        'latency_ms': {update_type: latency_summary(values) for update_type, values in latencies.items()},
+        'final_github_flush_ms': round(flush_elapsed * 1000, 1),
+        'duplicates_skipped': len(duplicates),
+        'failures': failures[:10],
+    }
+
+async def run_inflight(args, application, services):
+    # Clicks Publish/No on one draft, first with nothing else going on and then
+    # while --in-flight forwards are being processed; with every external call
+    # off the event loop the clicks are answered just as fast under load
+    probe_chat = 9_999
+    update_ids = itertools.count(1)
+    failures = []
+
+    probe = synthetic_promos(1, 1, 0, 0, 1, services.url)[0]
+    probe['message']['chat']['id'] = probe['message']['from']['id'] = probe_chat
+    probe['message']['message_id'] = probe['update_id'] = next(update_ids)
+    await process_update(application, probe)
+    publish_data = _button_data(services.last_markup(probe_chat), 'Publish')
+    await process_update(application, callback_update(next(update_ids), probe_chat, publish_data))
+    deny_data = _button_data(services.last_markup(probe_chat), 'No')
+    if publish_data is None or deny_data is None:
+        return {'failures': ['no Publish/No buttons on the probe draft']}
+
+    async def click_round():
+        latencies = []
+        for data in (publish_data, deny_data):
+            latencies.append(await process_update(application, callback_update(next(update_ids), probe_chat, data)))
+        return latencies
+
+    idle = []
+    for _ in range(args.probes):
+        idle.extend(await click_round())
+
+    forwards = synthetic_promos(args.in_flight, args.in_flight, args.photo_ratio, args.short_link_ratio,
+                                args.in_flight, services.url)
+    forward_latencies = []
+
+    async def forward(payload):
+        payload['update_id'] = payload['message']['message_id'] = next(update_ids)
+        forward_latencies.append(await process_update(application, payload))
+        if services.last_markup(payload['message']['chat']['id']) is None:
+            failures.append(f"chat {payload['message']['chat']['id']}: no draft")
+
+    started = time.perf_counter()
+    in_flight = asyncio.gather(*(forward(payload) for payload in forwards))
+    loaded = []
+    # Let every forward reach its first external call before probing
+    await asyncio.sleep(0)
+    while not in_flight.done():
+        loaded.extend(await click_round())
+    await in_flight
+    elapsed = time.perf_counter() - started
+
+    return {
+        'in_flight': args.in_flight,
+        'forwards_elapsed_s': round(elapsed, 3),
+        'latency_ms': {
+            'forward': latency_summary(forward_latencies),
+            'callback idle': latency_summary(idle),
+            'callback loaded': latency_summary(loaded),
+        },
+        'failures': failures[:10],
+    }
+
+async def run_feed(args, application, services):
+    # Publish cost as the item store grows: the store is filled to each size
+    # directly, then --feed-publishes entries are published one at a time. A
+    # full render of every stored item is what each publish used to cost
+    import rss_feed_generator
+    from config import RSS_STORE_PATH, RSS_MAX_ITEMS
+    from services import feed_entry
+
+    entry = feed_entry(
+        content="Deal of the day: wireless earbuds for $9.99 (-50%) https://s.click.aliexpress.com/e/_bench",
+        title="Deal of the day: wireless earb",
+        image=(f"https://raw.githubusercontent.com/{REPOSITORY}/main/cache-image/bench.jpg", 52_000, 'image/jpeg')
+    )
+    line = (json.dumps(rss_feed_generator._make_item(**entry)) + '\n').encode('utf-8')
+    sizes = sorted({size for size in (100, 1000, 2500, 5000) if size < args.feed_size} | {args.feed_size})
+
+    stored = 0
+    by_size = {}
+    for size in sizes:
+        with open(RSS_STORE_PATH, 'ab') as store:
+            store.write(line * (size - stored))
+        stored = size
+
+        # The store grew behind the module's back, as when another worker appends
+        started = time.perf_counter()
+        feed_size = len(rss_feed_generator.render_feed())
+        reload = time.perf_counter() - started
+
+        publishes = []
+        for _ in range(args.feed_publishes):
+            started = time.perf_counter()
+            rss_feed_generator.add_entries_to_rss_feed([entry])
+            publishes.append(time.perf_counter() - started)
+        stored += args.feed_publishes
+
+        with open(RSS_STORE_PATH, 'rb') as store:
+            items = [json.loads(item) for item in store]
+        started = time.perf_counter()
+        full_size = len(rss_feed_generator.render_items(items))
+        full_render = time.perf_counter() - started
+
+        by_size[str(size)] = {
+            **latency_summary(publishes),
+            'reload_ms': round(reload * 1000, 2),
+            'feed_bytes': feed_size,
+            'full_render_ms': round(full_render * 1000, 1),
+            'full_feed_bytes': full_size,
+        }
+    return {'max_items': RSS_MAX_ITEMS, 'latency_ms': by_size, 'failures': []}
+
+async def run_images(args, application, services):
+    # Replace Image on products with --product-images options, shown one photo
+    # after another (as before), concurrently, and as an album with one keyboard
+    import handlers_img
+
+    modes = {
+        'sequential': ('concurrent', 1),
+        'concurrent': ('concurrent', handlers_img.REPLACE_IMAGE_CONCURRENCY),
+        'album': ('album', handlers_img.REPLACE_IMAGE_CONCURRENCY),
+    }
+    chat_id = 10_000
+    update_ids = itertools.count(1)
+    promos = iter(synthetic_promos(args.image_rounds * len(modes), args.image_rounds * len(modes), 1, 0, 1, services.url))
+    latencies = {mode: [] for mode in modes}
+    bot_calls = {mode: 0 for mode in modes}
+    failures = []
+
+    for mode, (replace_mode, concurrency) in modes.items():
+        handlers_img.REPLACE_IMAGE_MODE, handlers_img.REPLACE_IMAGE_CONCURRENCY = replace_mode, concurrency
+        for _ in range(args.image_rounds):
+            promo = next(promos)
+            promo['update_id'] = promo['message']['message_id'] = next(update_ids)
+            await process_update(application, promo)
+            data = _button_data(services.last_markup(chat_id), 'Replace Image')
+            if data is None:
+                failures.append(f"{mode}: no draft")
+                continue
+
+            calls_before = sum(services.calls.values())
+            latencies[mode].append(await process_update(application, callback_update(next(update_ids), chat_id, data)))
+            bot_calls[mode] += sum(services.calls.values()) - calls_before
+
+            markup = services.last_markup(chat_id)
+            if mode == 'album':
+                # ❌ on the selection keyboard removes that photo and its row
+                await process_update(application, callback_update(next(update_ids), chat_id, _button_data(markup, '❌ 1'), markup))
+                if _button_data(services.last_markup(chat_id), '❌ 1') is not None:
+                    failures.append("album: ❌ 1 still on the selection keyboard")
+            elif _button_data(markup, '✅') is None:
+                failures.append(f"{mode}: no image options shown")
+
+    return {
+        'images': args.product_images,
+        'latency_ms': {mode: latency_summary(values) for mode, values in latencies.items()},
+        'bot_calls_per_click': {mode: round(bot_calls[mode] / max(1, len(latencies[mode])), 1) for mode in modes},
+        'failures': failures[:10],
+    }
+
+SCENARIOS = {
+    'flow': run_flow,
+    'inflight': run_inflight,
+    'feed': run_feed,
+    'images': run_images,
+}
+
+async def run_benchmark(args):
+    services = FakeServices(args.telegram_latency / 1000, args.github_latency / 1000, args.redirect_latency / 1000)
+    services.start()
+    configure_environment(args, services)
+
+    from logging_setup import setup_logging
+    setup_logging(level=args.log_level)
+
+    import clients
+    aliexpress = FakeAliexpressApi(args.aliexpress_latency / 1000, args.product_images)
+    clients._aliexpress = aliexpress
+
+    from main import build_application
+    from metrics import snapshot
+
+    application = build_application(updater=False)
+    try:
+        async with application:
+            await application.start()
+            result = await SCENARIOS[args.scenario](args, application, services)
+            await application.stop()
+    finally:
+        services.stop()
+
+    result.update({
+        'scenario': args.scenario,
+        'stages': snapshot()['stages'],
+        'api_calls': snapshot()['api_calls'],
+        'fake_calls': dict(sorted(services.calls.items())),
+        'aliexpress_calls': aliexpress.calls,
+        'github_commits': services.github_commits,
+        'github_bytes': services.github_bytes,
+    })
+    return result
+
+def print_latencies(result, baseline=None):
+    print(f"\n{'update':<16} {'count':>6} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    for update_type, values in result['latency_ms'].items():
+        print(f"{update_type:<16} {values['count']:>6} {values['p50']!s:>9} {values['p99']!s:>9} {values['mean']!s:>9}")
+        if baseline and update_type in baseline.get('latency_ms', {}):
+            before = baseline['latency_ms'][update_type]
+            print(f"{'  baseline':<16} {before['count']:>6} {before['p50']!s:>9} {before['p99']!s:>9} {before['mean']!s:>9}")
+
+def print_inflight(result, baseline=None):
+    if 'latency_ms' in result:
+        print(f"{result['in_flight']} forwards in flight, all processed in {result['forwards_elapsed_s']}s")
+        print_latencies(result, baseline)
+        idle, loaded = result['latency_ms']['callback idle'], result['latency_ms']['callback loaded']
+        if idle['p50'] and loaded['p50']:
+            print(f"\nCallback p50 under load: {loaded['p50'] / idle['p50']:.2f}x idle ({loaded['count']} answered while forwards were in flight)")
+    for failure in result['failures']:
+        print(f"failure: {failure}")
+
+def print_feed(result, baseline=None):
+    print(f"Publishing one entry as the store grows (feed window: {result['max_items']} items)")
+    print(f"\n{'stored':>7} {'p50 ms':>8} {'p99 ms':>8} {'reload ms':>10} {'feed KB':>8} {'full render ms':>15} {'full KB':>8}")
+    for size, values in result['latency_ms'].items():
+        print(f"{size:>7} {values['p50']!s:>8} {values['p99']!s:>8} {values['reload_ms']!s:>10} {values['feed_bytes'] / 1024:>8.0f} "
+              f"{values['full_render_ms']!s:>15} {values['full_feed_bytes'] / 1024:>8.0f}")
+        if baseline and size in baseline.get('latency_ms', {}):
+            before = baseline['latency_ms'][size]
+            print(f"{'  base':>7} {before['p50']!s:>8} {before['p99']!s:>8} {before['reload_ms']!s:>10}")
+
+def print_images(result, baseline=None):
+    print(f"Replace Image on products with {result['images']} images")
+    print_latencies(result, baseline)
+    print(f"\nBot API calls per click: {result['bot_calls_per_click']}")
+    sequential, album = result['latency_ms']['sequential']['p50'], result['latency_ms']['album']['p50']
+    if sequential and album:
+        print(f"Album p50 is {sequential / album:.1f}x faster than one photo after another")
+    for failure in result['failures']:
+        print(f"failure: {failure}")
+
+def print_report(result, baseline=None):
+    print(f"{result['promos']} promos, {result['updates']} updates in {result['elapsed_s']}s: {result['updates_per_s']} updates/s")
+    if baseline:
+        print(f"  baseline: {baseline['updates_per_s']} updates/s")
+    print_latencies(result, baseline)
+
+    print('\nStages (count / avg / p50 / p99 ms):')
+    for stage, values in result['stages'].items():
+        print(f"  {stage}: {values['count']} / {values['avg_ms']} / {values['p50_ms']:g} / {values['p99_ms']:g}")
+    print(f"\nAPI calls: {result['api_calls']}")
+    print(f"Fake service calls: {result['fake_calls']}")
+    print(f"GitHub: {result['github_commits']} commits, {result['github_bytes']} bytes; final flush {result['final_github_flush_ms']}ms")
+    if result.get('duplicates_skipped'):
+        print(f"Duplicates skipped: {result['duplicates_skipped']}")
+    for failure in result['failures']:
+        print(f"failure: {failure}")
+
+REPORTS = {
+    'flow': print_report,
+    'inflight': print_inflight,
+    'feed': print_feed,
+    'images': print_images,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bot against local fake services')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='flow',
+                        help='flow: forward/Publish/Yes per promo; inflight: callback latency while forwards are in flight; '
+                             'feed: publish cost as the feed store grows; images: Replace Image per display mode')
+    parser.add_argument('--promos', type=int, default=100, help='synthetic promos to run (forward, Publish, Yes each)')
+    parser.add_argument('--products', type=int, default=0, help='distinct products among the promos (default: all distinct)')
+    parser.add_argument('--chats', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=20, help='chats processed at the same time')
+    parser.add_argument('--photo-ratio', type=float, default=0.5)
+    parser.add_argument('--short-link-ratio', type=float, default=0.25)
+    parser.add_argument('--telegram-latency', type=float, default=30, help='ms per Bot API call')
+    parser.add_argument('--aliexpress-latency', type=float, default=150, help='ms per AliExpress API call')
+    parser.add_argument('--github-latency', type=float, default=80, help='ms per GitHub API call')
+    parser.add_argument('--redirect-latency', type=float, default=50, help='ms per short-link hop')
+    parser.add_argument('--github-debounce', type=float, default=1.0)
+    parser.add_argument('--dedupe', action='store_true', help='keep duplicate detection on; repeated products are then skipped')
+    parser.add_argument('--rate-limits', action='store_true', help='keep the configured Telegram send rate limits')
+    parser.add_argument('--replay', help='JSON-lines file of recorded Telegram updates; forwarded messages are replayed')
+    parser.add_argument('--in-flight', type=int, default=50, help='inflight: forwards processed at the same time')
+    parser.add_argument('--probes', type=int, default=10, help='inflight: Publish/No rounds clicked with nothing in flight')
+    parser.add_argument('--feed-size', type=int, default=10000, help='feed: largest item store measured')
+    parser.add_argument('--feed-publishes', type=int, default=50, help='feed: entries published at each store size')
+    parser.add_argument('--product-images', type=int, default=10, help='images per product, offered by Replace Image')
+    parser.add_argument('--image-rounds', type=int, default=5, help='images: Replace Image clicks per display mode')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--save', help='write the result as JSON, e.g. a baseline')
+    parser.add_argument('--compare', help='print a saved result next to this run')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(os.path.abspath(args.compare), encoding='utf-8') as file:
+            baseline = json.load(file)
+    save_path = os.path.abspath(args.save) if args.save else None
+    if args.replay:
+        args.replay = os.path.abspath(args.replay)
+
+    result = asyncio.run(run_benchmark(args))
+    REPORTS[args.scenario](result, baseline)
+    if save_path:
+        with open(save_path, 'w', encoding='utf-8') as file:
+            json.dump(result, file, indent=2)
+    if result['failures']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+## bulk_import.py
+#
+# Imports a Telegram Desktop channel export (result.json) into the feed in one
+# run: links are parsed once, product lookups go through the batcher with
+# bounded concurrency, affiliate links are generated in bulk per chunk, and
+# the feed and every image are pushed to GitHub in a single commit at the end.
+#   python bulk_import.py path/to/export/result.json --concurrency 10
+#
+# Progress is checkpointed after every chunk (next to the export by default);
+# running the same command again resumes where it stopped.
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from config import ALIEXPRESS_TRACKING_ID, PRODUCT_BATCH_MAX, RSS_FEED_PATH
+from link_parser import parse_links, is_convertible, ALIEXPRESS_KINDS
+from services import (run_blocking, fetch_product_details_async, generate_affiliate_links_async,
+                      convert_affiliate_links_async, feed_entry, image_path)
+from image_processing import process_image_async
+from rss_feed_generator import add_entries_to_rss_feed, write_feed
+from cache import uploaded_images
+from github_sync import github_sync
+from dedupe import deal_keys, deal_record, find_duplicate, remember
+from logging_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+def message_text(message):
+    # Exports keep formatted text as a list of plain strings and entity dicts;
+    # hidden text links are spelled out so their URLs get converted too
+    text = message.get('text', '')
+    if isinstance(text, str):
+        return text
+    parts = []
+    for part in text:
+        if isinstance(part, str):
+            parts.append(part)
+        elif part.get('type') == 'text_link' and part.get('href') and part['href'] != part.get('text'):
+            parts.append(f"{part.get('text', '')} {part['href']}")
+        else:
+            parts.append(part.get('text', ''))
+    return ''.join(parts)
+
+def message_date(message):
+    if message.get('date_unixtime'):
+        return datetime.fromtimestamp(int(message['date_unixtime']), timezone.utc)
+    if message.get('date'):
+        date = datetime.fromisoformat(message['date'])
+        return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+    return None
+
+def load_export(path):
+    with open(path, encoding='utf-8') as file:
+        export = json.load(file)
+    return [message for message in export.get('messages', []) if message.get('type') == 'message']
+
+def load_checkpoint(path, export_path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as file:
+        checkpoint = json.load(file)
+    if checkpoint.get('export') != export_path:
+        raise SystemExit(f"{path} belongs to another export ({checkpoint.get('export')}); pass --restart to start over")
+    return checkpoint
+
+def save_checkpoint(path, checkpoint):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(checkpoint, file)
+    os.replace(temp_path, path)
+
+class BulkImporter:
+    def __init__(self, export_path, checkpoint_path, concurrency, chunk_size):
+        self.export_dir = os.path.dirname(export_path)
+        self.checkpoint_path = checkpoint_path
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.checkpoint = {
+            'export': export_path,
+            'next_index': 0,
+            'imported': 0,
+            'skipped': 0,
+            # GitHub path -> [export file, content hash, byte length, mime type], for images not pushed yet
+            'images': {},
+            'pushed': False,
+        }
+
+    async def _bounded(self, coroutine):
+        async with self._semaphore:
+            return await coroutine
+
+    async def _stage_image(self, export_file):
+        # Returns (image_url, byte length, mime type) like upload_image_async, staged instead of scheduled
+        try:
+            with open(os.path.join(self.export_dir, export_file), 'rb') as file:
+                content = file.read()
+        except OSError as e:
+            logger.warning("Skipping image %s: %s", export_file, e)
+            return None
+        content_hash = hashlib.sha256(content).hexdigest()
+        uploaded = uploaded_images.get(content_hash)
+        if uploaded:
+            return tuple(uploaded)
+
+        processed = await process_image_async(content)
+        if processed is None:
+            logger.warning("Skipping image %s: not a known image format", export_file)
+            return None
+        processed, mime_type, extension = processed
+        path = image_path(content_hash, extension)
+        github_sync.stage(path, processed)
+        self.checkpoint['images'][path] = [export_file, content_hash, len(processed), mime_type]
+        return github_sync.raw_url(path), len(processed), mime_type
+
+    async def restage_images(self):
+        # Staged files only live in memory, so images from an interrupted run are staged again
+        images = self.checkpoint['images']
+        if not images:
+            return
+        logger.info("Restaging %s images from the previous run", len(images))
+
+        async def restage(path, export_file):
+            with open(os.path.join(self.export_dir, export_file), 'rb') as file:
+                content = file.read()
+            processed = await process_image_async(content)
+            if processed is not None:
+                github_sync.stage(path, processed[0])
+
+        await asyncio.gather(*(self._bounded(restage(path, entry[0])) for path, entry in images.items()))
+
+    async def import_chunk(self, messages):
+        promos = []
+        chunk_seen = {}
+        for message in messages:
+            content = message_text(message)
+            links = parse_links(content, ALIEXPRESS_TRACKING_ID) if content else []
+            url = next((link.url for link in links if link.kind in ALIEXPRESS_KINDS), None)
+            if not url:
+                continue
+            # Channels repost the same deal; only its first copy goes into the feed
+            dedupe_keys = deal_keys(content, links, url)
+            if find_duplicate(dedupe_keys, chunk_seen) or find_duplicate(dedupe_keys):
+                continue
+            chunk_seen.update(dict.fromkeys(dedupe_keys, deal_record(dedupe_keys, 'published')))
+            promos.append((message, content, links, url, dedupe_keys))
+
+        details = await asyncio.gather(*(self._bounded(fetch_product_details_async(url)) for _, _, _, url, _ in promos))
+
+        # One bulk call for the whole chunk; the per-message conversions below then come from the cache
+        await generate_affiliate_links_async([link.url for _, _, links, _, _ in promos for link in links if is_convertible(link)])
+
+        async def build_entry(message, content, links):
+            converted, _ = await convert_affiliate_links_async(content, links)
+            image = None
+            if message.get('photo'):
+                image = await self._stage_image(message['photo'])
+            return feed_entry(
+                content=converted,
+                title=content[:30] if len(content) > 30 else None,
+                description=converted,
+                image=image,
+                published=message_date(message)
+            )
+
+        found = [(promo, product) for promo, product in zip(promos, details) if product]
+        entries = await asyncio.gather(*(self._bounded(build_entry(message, content, links))
+                                         for (message, content, links, _, _), _ in found))
+        if entries:
+            await run_blocking(add_entries_to_rss_feed, entries, timeout=None)
+        # Marked only once written, so a run interrupted mid-chunk doesn't skip these on resume
+        for (_, _, _, _, dedupe_keys), _ in found:
+            remember(dedupe_keys, 'published')
+        return len(entries)
+
+    async def run(self, messages):
+        await self.restage_images()
+        started = time.perf_counter()
+        start_index = self.checkpoint['next_index']
+        for index in range(start_index, len(messages), self.chunk_size):
+            chunk = messages[index:index + self.chunk_size]
+            imported = await self.import_chunk(chunk)
+            self.checkpoint['next_index'] = index + len(chunk)
+            self.checkpoint['imported'] += imported
+            self.checkpoint['skipped'] += len(chunk) - imported
+            save_checkpoint(self.checkpoint_path, self.checkpoint)
+
+            done = self.checkpoint['next_index']
+            rate = (done - start_index) / (time.perf_counter() - started)
+            remaining = (len(messages) - done) / rate if rate else 0
+            print(f"{done}/{len(messages)} messages, {self.checkpoint['imported']} imported, "
+                  f"{self.checkpoint['skipped']} skipped, {rate:.1f} msg/s, ~{remaining:.0f}s left", flush=True)
+
+        await self.push()
+
+    async def push(self):
+        if self.checkpoint['pushed']:
+            return
+        github_sync.stage(RSS_FEED_PATH, write_feed)
+        files = github_sync.pending_count()
+        commit_sha = await run_blocking(github_sync.push_pending, f"Import {self.checkpoint['imported']} promos", timeout=None)
+        if commit_sha is None:
+            raise SystemExit("GitHub push failed; run again to retry from the checkpoint")
+
+        for path, (_, content_hash, length, mime_type) in self.checkpoint['images'].items():
+            uploaded_images.set(content_hash, [github_sync.raw_url(path), length, mime_type])
+        self.checkpoint['images'] = {}
+        self.checkpoint['pushed'] = True
+        save_checkpoint(self.checkpoint_path, self.checkpoint)
+        print(f"Pushed {files} files to GitHub in commit {commit_sha[:7]}")
+
+async def run_import(args):
+    export_path = os.path.abspath(args.export)
+    checkpoint_path = os.path.abspath(args.checkpoint or f"{export_path}.checkpoint.json")
+    messages = load_export(export_path)
+
+    importer = BulkImporter(export_path, checkpoint_path, args.concurrency, args.chunk_size)
+    checkpoint = None if args.restart else load_checkpoint(checkpoint_path, export_path)
+    if checkpoint:
+        if checkpoint['pushed'] and checkpoint['next_index'] >= len(messages):
+            print(f"{export_path} was already imported; pass --restart to import it again")
+            return
+        importer.checkpoint = checkpoint
+        # New messages after a finished import need another push
+        importer.checkpoint['pushed'] = False
+        print(f"Resuming at message {checkpoint['next_index']} of {len(messages)}")
+    await importer.run(messages)
+
+def main():
+    parser = argparse.ArgumentParser(description='Import a Telegram channel export into the promo feed')
+    parser.add_argument('export', help="the export's result.json")
+    parser.add_argument('--concurrency', type=int, default=10, help='product lookups and image jobs in flight')
+    parser.add_argument('--chunk-size', type=int, default=PRODUCT_BATCH_MAX * 5, help='messages per checkpoint')
+    parser.add_argument('--checkpoint', help='checkpoint file (default: next to the export)')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing checkpoint')
+    args = parser.parse_args()
+
+    setup_logging()
+    asyncio.run(run_import(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+## cache.py
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import (ensure_parent_dir, CACHE_DB_PATH, CACHE_MAX_ENTRIES, PRODUCT_CACHE_TTL, AFFILIATE_CACHE_TTL, SHORT_LINK_CACHE_TTL,
+                    IMAGE_INDEX_TTL, DEDUPE_WINDOW, DEDUPE_MAX_ENTRIES)
+
+logger = logging.getLogger(__name__)
+
+# How many writes happen between sweeps of expired rows on disk
+PRUNE_EVERY = 200
+
+_connection = None
+_connection_lock = threading.Lock()
+
+def _get_connection():
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            ensure_parent_dir(CACHE_DB_PATH)
+            _connection = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False, timeout=5)
+            _connection.execute("PRAGMA journal_mode=WAL")
+        return _connection
+
+# LRU cache with per-entry TTL, backed by a SQLite table so entries survive restarts
+class TTLCache:
+    def __init__(self, name, ttl, max_entries=CACHE_MAX_ENTRIES, persistent=True):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._table_ready = False
+
+    def _db(self):
+        connection = _get_connection()
+        if not self._table_ready:
+            with _connection_lock:
+                connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.name} "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                connection.commit()
+            self._table_ready = True
+        return connection
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        value = self._load(key, now) if self.persistent else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        if self.persistent:
+            self._store(key, value, expires_at)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.persistent:
+            try:
+                connection = self._db()
+                with _connection_lock:
+                    connection.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+                    connection.commit()
+            except sqlite3.Error as e:
+                logger.error("Cache %s: failed to delete %s: %s", self.name, key, e)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+            }
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, key, now):
+        try:
+            connection = self._db()
+            with _connection_lock:
+                row = connection.execute(
+                    f"SELECT value, expires_at FROM {self.name} WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error("Cache %s: failed to read %s: %s", self.name, key, e)
+            return None
+        if row is None or row[1] <= now:
+            return None
+        value = json.loads(row[0])
+        self._remember(key, value, row[1])
+        return value
+
+    def _store(self, key, value, expires_at):
+        try:
+            connection = self._db()
+            with _connection_lock:
+                connection.execute(
+                    f"INSERT OR REPLACE INTO {self.name} (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at)
+                )
+                self._writes += 1
+                if self._writes % PRUNE_EVERY == 0:
+                    self._prune(connection)
+                connection.commit()
+        except sqlite3.Error as e:
+            logger.error("Cache %s: failed to write %s: %s", self.name, key, e)
+
+    def _prune(self, connection):
+        connection.execute(f"DELETE FROM {self.name} WHERE expires_at <= ?", (time.time(),))
+        # Keep the on-disk table bounded the same way as the in-memory LRU
+        connection.execute(
+            f"DELETE FROM {self.name} WHERE key NOT IN "
+            f"(SELECT key FROM {self.name} ORDER BY expires_at DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+
+product_cache = TTLCache('product_details', PRODUCT_CACHE_TTL)
+affiliate_cache = TTLCache('affiliate_links', AFFILIATE_CACHE_TTL)
+short_link_cache = TTLCache('short_links', SHORT_LINK_CACHE_TTL)
+uploaded_images = TTLCache('uploaded_images', IMAGE_INDEX_TTL)
+seen_deals = TTLCache('seen_deals', DEDUPE_WINDOW, DEDUPE_MAX_ENTRIES)
+
+def cache_stats():
+    return {cache.name: cache.stats() for cache in (product_cache, affiliate_cache, short_link_cache, uploaded_images, seen_deals)}
@@ -0,0 +1,134 @@
+## callbacks.py
+
+import inspect
+import logging
+from functools import lru_cache
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+from config import DRAFT_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects callback_data longer than this many bytes
+CALLBACK_DATA_LIMIT = 64
+
+# One character per command; the rest of the payload is the integers it needs
+# (chat id, draft message id, image index) in base 36, dot-separated. Base 36 is
+# nearly as short as packed bytes and decodes with int(value, 36) alone
+COMMAND_CODES = {
+    'replace_image': 'r',
+    'edit_text': 'e',
+    'publish': 'p',
+    'cancel': 'c',
+    'confirm_publish': 'P',
+    'deny_publish': 'n',
+    'confirm_cancel': 'C',
+    'deny_cancel': 'N',
+    'select_image': 's',
+    'remove_image': 'x',
+}
+
+BASE36_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+def _base36(value):
+    if value < 0:
+        return '-' + _base36(-value)
+    digits = ''
+    while True:
+        value, digit = divmod(value, 36)
+        digits = BASE36_DIGITS[digit] + digits
+        if not value:
+            return digits
+
+def encode(command, *values):
+    data = COMMAND_CODES[command] + '.'.join(_base36(value) for value in values)
+    if len(data) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data for {command} is {len(data)} bytes")
+    return data
+
+# Command codes map straight to their handler: one dict lookup per button press.
+# Handlers take (update, context, chat_id, message_id, *values); how many values
+# a handler accepts is read from its signature once, when it is registered
+class CallbackRouter:
+    def __init__(self):
+        # code -> (handler, fewest values, most values), chat id included
+        self.handlers = {}
+
+    def route(self, command):
+        def register(handler):
+            parameters = list(inspect.signature(handler).parameters.values())[2:]
+            required = sum(1 for parameter in parameters if parameter.default is parameter.empty)
+            if required < 2:
+                raise TypeError(f"{handler.__name__} must take chat_id and message_id")
+            self.handlers[COMMAND_CODES[command]] = (handler, required, len(parameters))
+            return handler
+        return register
+
+    async def _dispatch_legacy(self, update, context, data, chat_id):
+        # "command:message_id[:idx]" carries no chat id; it was only ever sent
+        # to the chat that pressed it
+        command, *values = data.split(':')
+        try:
+            handler, required, accepted = self.handlers[COMMAND_CODES[command]]
+            values = [chat_id] + [int(value) for value in values]
+        except (KeyError, ValueError):
+            logger.warning("Malformed callback data: %r", data)
+            return
+        if not required <= len(values) <= accepted:
+            logger.warning("Callback data %r has %s values, %s takes %s to %s", data, len(values), handler.__name__, required, accepted)
+            return
+        await handler(update, context, *values)
+
+    async def dispatch(self, update, context):
+        query = update.callback_query
+        await query.answer()
+        data = query.data
+        chat_id = query.message.chat_id
+        if ':' in data:
+            await self._dispatch_legacy(update, context, data, chat_id)
+            return
+        try:
+            handler, required, accepted = self.handlers[data[0]]
+        except (KeyError, IndexError):
+            logger.warning("Malformed callback data: %r", data)
+            return
+        values = data[1:].split('.')
+        if not required <= len(values) <= accepted:
+            logger.warning("Callback data %r has %s values, %s takes %s to %s", data, len(values), handler.__name__, required, accepted)
+            return
+        # The chat id and draft message id are parsed directly; a list
+        # comprehension costs more than both int() calls on Python 3.11
+        try:
+            payload_chat_id = int(values[0], 36)
+            message_id = int(values[1], 36)
+            extra = [int(value, 36) for value in values[2:]] if len(values) > 2 else ()
+        except ValueError:
+            logger.warning("Malformed callback data: %r", data)
+            return
+        # The chat id in the payload must match the chat the button was pressed in
+        if payload_chat_id != chat_id:
+            logger.warning("Callback for chat %s pressed in chat %s", payload_chat_id, chat_id)
+            return
+        await handler(update, context, chat_id, message_id, *extra)
+
+router = CallbackRouter()
+
+# Keyboard layouts as (label, command) rows. Markups are immutable, so each one
+# is built once per draft and reused for every later send or edit
+DRAFT_KEYBOARD = (
+    (("Replace Image", 'replace_image'),),
+    (("Edit Text", 'edit_text'),),
+    (("Publish", 'publish'),),
+    (("Cancel", 'cancel'),),
+)
+CONFIRM_PUBLISH_KEYBOARD = ((("Yes", 'confirm_publish'),), (("No", 'deny_publish'),))
+CONFIRM_CANCEL_KEYBOARD = ((("Yes", 'confirm_cancel'),), (("No", 'deny_cancel'),))
+
+@lru_cache(maxsize=DRAFT_MAX_ENTRIES)
+def keyboard(layout, chat_id, message_id):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(label, callback_data=encode(command, chat_id, message_id)) for label, command in row]
+        for row in layout
+    ])
+
+def draft_keyboard(chat_id, message_id):
+    return keyboard(DRAFT_KEYBOARD, chat_id, message_id)
@@ -0,0 +1,36 @@
+## clients.py
+
+import logging
+import threading
+from config import ALIEXPRESS_KEY, ALIEXPRESS_SECRET, ALIEXPRESS_TRACKING_ID, HTTP_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Shared clients, built once on first use so importing a module stays cheap
+_aliexpress = None
+_http_session = None
+_lock = threading.Lock()
+
+def get_aliexpress_client():
+    global _aliexpress
+    if _aliexpress is None:
+        with _lock:
+            if _aliexpress is None:
+                from aliexpress_api import AliexpressApi, models
+                _aliexpress = AliexpressApi(ALIEXPRESS_KEY, ALIEXPRESS_SECRET, models.Language.EN, models.Currency.USD, ALIEXPRESS_TRACKING_ID)
+                logger.info("AliExpress API client created")
+    return _aliexpress
+
+def get_http_session():
+    # One keep-alive session shared by every plain HTTP call (short-link resolution, image downloads)
+    global _http_session
+    if _http_session is None:
+        with _lock:
+            if _http_session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                session.mount('https://', HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+                session.mount('http://', HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+                _http_session = session
+    return _http_session
@@ -3,13 +3,132 @@
 import os
 from dotenv import load_dotenv
 
-load_dotenv()
+# The one place .env is loaded; every module reads its settings from here
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
 TELEGRAM_API_TOKEN = os.getenv('TELEGRAM_API_TOKEN')
 GIT_TOKEN = os.getenv('GIT_TOKEN')
 GITHUB_REPOSITORY = os.getenv('GITHUB_REPOSITORY')
 RSS_FEED_PATH = 'rss-feed_promo.xml'
 
-# Ensure the cache directory exists
-CACHE_DIR = "C:\\Bots\\cache-promo"
-if not os.path.exists(CACHE_DIR):
-    os.makedirs(CACHE_DIR)
+ALIEXPRESS_KEY = os.getenv('ALIEXPRESS_KEY')
+ALIEXPRESS_SECRET = os.getenv('ALIEXPRESS_SECRET')
+ALIEXPRESS_TRACKING_ID = os.getenv('ALIEXPRESS_TRACKING_ID')
+
+# Created on first use rather than at import, see ensure_parent_dir()
+CACHE_DIR = os.getenv('CACHE_DIR', "C:\\Bots\\cache-promo")
+
+def ensure_parent_dir(path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+
+# Blocking AliExpress/GitHub calls are offloaded to a bounded thread pool
+SERVICE_MAX_WORKERS = int(os.getenv('SERVICE_MAX_WORKERS', '8'))
+SERVICE_TIMEOUT = float(os.getenv('SERVICE_TIMEOUT', '30'))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '10'))
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '64'))
+
+# Product details and affiliate links are cached in memory and in SQLite
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', os.path.join(CACHE_DIR, 'promo-cache.sqlite3'))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '5000'))
+PRODUCT_CACHE_TTL = int(os.getenv('PRODUCT_CACHE_TTL', str(6 * 60 * 60)))
+AFFILIATE_CACHE_TTL = int(os.getenv('AFFILIATE_CACHE_TTL', str(24 * 60 * 60)))
+
+# Product lookups arriving within this window are sent as one get_products_details call
+PRODUCT_BATCH_WINDOW_MS = int(os.getenv('PRODUCT_BATCH_WINDOW_MS', '50'))
+PRODUCT_BATCH_MAX = int(os.getenv('PRODUCT_BATCH_MAX', '20'))
+
+# Maximum number of source URLs sent in one get_affiliate_links call
+AFFILIATE_BATCH_SIZE = int(os.getenv('AFFILIATE_BATCH_SIZE', '20'))
+
+# Short-link resolution: pooled keep-alive session, bounded redirect chain
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+MAX_REDIRECTS = int(os.getenv('MAX_REDIRECTS', '5'))
+SHORT_LINK_CACHE_TTL = int(os.getenv('SHORT_LINK_CACHE_TTL', str(30 * 24 * 60 * 60)))
+
+# Forwarded deals already seen within this window are skipped: the same product ID, or the
+# same wording unless the two deals link different product IDs
+DEDUPE_WINDOW = int(os.getenv('DEDUPE_WINDOW', str(3 * 24 * 60 * 60)))
+DEDUPE_MAX_ENTRIES = int(os.getenv('DEDUPE_MAX_ENTRIES', '20000'))
+
+# Feed items are appended to a JSON-lines store; the XML only renders the newest RSS_MAX_ITEMS
+RSS_STORE_PATH = os.getenv('RSS_STORE_PATH', 'rss-feed_promo.jsonl')
+RSS_MAX_ITEMS = int(os.getenv('RSS_MAX_ITEMS', '100'))
+
+# Feed and image changes are pushed to GitHub as one commit per debounce window
+GITHUB_API_URL = os.getenv('GITHUB_API_URL', 'https://api.github.com')
+GITHUB_BRANCH = os.getenv('GITHUB_BRANCH', 'main')
+GITHUB_SYNC_DEBOUNCE = float(os.getenv('GITHUB_SYNC_DEBOUNCE', '5'))
+GITHUB_SYNC_MAX_DELAY = float(os.getenv('GITHUB_SYNC_MAX_DELAY', '30'))
+GITHUB_SYNC_RETRIES = int(os.getenv('GITHUB_SYNC_RETRIES', '3'))
+# A failed push is retried on its own, backing off up to this many seconds between attempts
+GITHUB_SYNC_MAX_BACKOFF = float(os.getenv('GITHUB_SYNC_MAX_BACKOFF', '300'))
+
+# Drafts awaiting publish/cancel: 'memory' or 'sqlite' backend, expired after DRAFT_TTL seconds
+DRAFT_STORE_BACKEND = os.getenv('DRAFT_STORE_BACKEND', 'memory')
+DRAFT_DB_PATH = os.getenv('DRAFT_DB_PATH', os.path.join(CACHE_DIR, 'drafts.sqlite3'))
+DRAFT_TTL = int(os.getenv('DRAFT_TTL', str(48 * 60 * 60)))
+DRAFT_MAX_ENTRIES = int(os.getenv('DRAFT_MAX_ENTRIES', '1000'))
+
+# Webhook mode: a local dispatcher fans Telegram updates out to WEBHOOK_WORKERS processes
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+# Point the bot at another Bot API server (e.g. a local one) instead of api.telegram.org
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL')
+TELEGRAM_API_BASE_FILE_URL = os.getenv('TELEGRAM_API_BASE_FILE_URL')
+
+# Uploaded images are remembered by content hash so the same photo is never pushed twice
+IMAGE_INDEX_TTL = int(os.getenv('IMAGE_INDEX_TTL', str(365 * 24 * 60 * 60)))
+CACHE_FILE_MAX_AGE = int(os.getenv('CACHE_FILE_MAX_AGE', str(24 * 60 * 60)))
+
+# Published images are resized and recompressed in a process pool before upload
+IMAGE_MAX_WIDTH = int(os.getenv('IMAGE_MAX_WIDTH', '1280'))
+IMAGE_MAX_HEIGHT = int(os.getenv('IMAGE_MAX_HEIGHT', '1280'))
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'JPEG').upper()
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '80'))
+IMAGE_PROCESS_WORKERS = int(os.getenv('IMAGE_PROCESS_WORKERS', '2'))
+
+# How replacement image candidates are shown: 'album' (media groups plus one keyboard) or 'concurrent'
+REPLACE_IMAGE_MODE = os.getenv('REPLACE_IMAGE_MODE', 'album')
+REPLACE_IMAGE_CONCURRENCY = int(os.getenv('REPLACE_IMAGE_CONCURRENCY', '5'))
+
+# Draft cleanup: parallel deletes when bulk delete_messages isn't available. DEFER_CLEANUP
+# replies before the deletes finish, and their failures are only logged
+DELETE_CONCURRENCY = int(os.getenv('DELETE_CONCURRENCY', '5'))
+DEFER_CLEANUP = os.getenv('DEFER_CLEANUP', 'false').lower() in ('1', 'true', 'yes')
+
+# Outbound Telegram calls: token buckets globally and per chat, retried after flood waits
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '30'))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))
+SEND_CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', '3'))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '3'))
+
+# Scheduled publishing: approved drafts are queued and posted PUBLISH_SLOT_SIZE at a time
+# every PUBLISH_SLOT_MINUTES; 0 publishes immediately on confirmation
+PUBLISH_SLOT_MINUTES = float(os.getenv('PUBLISH_SLOT_MINUTES', '0'))
+PUBLISH_SLOT_SIZE = int(os.getenv('PUBLISH_SLOT_SIZE', '1'))
+PUBLISH_QUEUE_DB_PATH = os.getenv('PUBLISH_QUEUE_DB_PATH', os.path.join(CACHE_DIR, 'publish-queue.sqlite3'))
+# A queued post that fails this many times (or once with a BadRequest) is taken off the queue and reported
+PUBLISH_MAX_ATTEMPTS = int(os.getenv('PUBLISH_MAX_ATTEMPTS', '3'))
+
+# Startup budget checked by startup_report.py, in seconds
+STARTUP_TARGET_SECONDS = float(os.getenv('STARTUP_TARGET_SECONDS', '1.5'))
+
+# Stage latency histograms behind /stats; METRICS_PORT > 0 also serves them as Prometheus text
+# (webhook workers listen on METRICS_PORT + worker index), bound to METRICS_HOST; set it to
+# 0.0.0.0 only when the scraper runs on another machine
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# Comma-separated Telegram user IDs allowed to run /stats; empty allows no one
+STATS_ADMIN_IDS = {int(user_id) for user_id in os.getenv('STATS_ADMIN_IDS', '').split(',') if user_id.strip()}
+
+# Logging: records go through a queue to a background thread; API payloads are logged
+# at DEBUG for roughly one call in LOG_PAYLOAD_SAMPLE_EVERY, cut to LOG_PAYLOAD_MAX_CHARS
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_PAYLOAD_SAMPLE_EVERY = int(os.getenv('LOG_PAYLOAD_SAMPLE_EVERY', '100'))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '2000'))
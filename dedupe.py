@@ -0,0 +1,81 @@
+## dedupe.py
+
+import hashlib
+import re
+import threading
+import time
+from cache import seen_deals, short_link_cache
+from link_parser import ALIEXPRESS_ITEM, ALIEXPRESS_KINDS
+
+WORD_PATTERN = re.compile(r'\w+')
+
+# Shorter wording ("Look at this!") is too generic to identify a deal by itself
+MIN_FINGERPRINT_CHARS = 20
+
+_claim_lock = threading.Lock()
+
+def text_fingerprint(content, links):
+    # Links differ per source channel (tracking, short links), so only the words between them count
+    parts = []
+    position = 0
+    for link in links:
+        parts.append(content[position:link.start])
+        position = link.end
+    parts.append(content[position:])
+    normalized = ' '.join(WORD_PATTERN.findall(''.join(parts).lower()))
+    if len(normalized) < MIN_FINGERPRINT_CHARS:
+        return None
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).hexdigest()
+
+def deal_keys(content, links, url):
+    # Keys for the deal's product and its wording, found without any API call:
+    # item links carry the product ID and resolved short links are cached
+    keys = []
+    link = next((link for link in links if link.url == url), None)
+    if link is not None and link.kind in ALIEXPRESS_KINDS:
+        product_id = link.product_id if link.kind == ALIEXPRESS_ITEM else short_link_cache.get(url.strip())
+        if product_id:
+            keys.append(f"product:{product_id}")
+    fingerprint = text_fingerprint(content, links)
+    if fingerprint:
+        keys.append(f"text:{fingerprint}")
+    return keys
+
+def _product_id(keys):
+    return next((key[len('product:'):] for key in keys if key.startswith('product:')), None)
+
+def deal_record(keys, state, chat_id=None, message_id=None):
+    return {'state': state, 'chat_id': chat_id, 'message_id': message_id, 'product_id': _product_id(keys), 'seen_at': time.time()}
+
+def find_duplicate(keys, seen=seen_deals):
+    # The same product is always a duplicate. The same wording is too, unless both
+    # deals have a product ID and they differ: channels reuse boilerplate across products
+    product_id = _product_id(keys)
+    for key in keys:
+        record = seen.get(key)
+        if not record:
+            continue
+        if key.startswith('text:') and product_id and record.get('product_id') and record['product_id'] != product_id:
+            continue
+        return record
+    return None
+
+def remember(keys, state, chat_id=None, message_id=None):
+    record = deal_record(keys, state, chat_id, message_id)
+    for key in keys:
+        seen_deals.set(key, record)
+
+def claim(keys, chat_id, message_id, still_open=None):
+    # find_duplicate and remember as one step, so of two copies looked up at the
+    # same time only one gets the keys. Returns the duplicate's record, or None
+    # once the keys are claimed for this draft; blocking, so run it off the event loop
+    with _claim_lock:
+        duplicate = find_duplicate(keys)
+        if duplicate and (still_open is None or still_open(duplicate)):
+            return duplicate
+        remember(keys, 'draft', chat_id, message_id)
+        return None
+
+def forget(keys):
+    for key in keys:
+        seen_deals.delete(key)
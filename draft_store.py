@@ -0,0 +1,257 @@
+## draft_store.py
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Optional
+from config import ensure_parent_dir, DRAFT_STORE_BACKEND, DRAFT_DB_PATH, DRAFT_TTL, DRAFT_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True, slots=True)
+class Product:
+    product_id: str
+    title: str
+    small_images: tuple = ()
+
+# One Product per product ID, shared by every draft of that product
+_products = OrderedDict()
+_products_lock = threading.Lock()
+
+def intern_product(product_id, title, small_images=()):
+    product_id = str(product_id)
+    small_images = tuple(small_images)
+    with _products_lock:
+        product = _products.get(product_id)
+        if product is None or product.title != title or product.small_images != small_images:
+            product = Product(product_id, title, small_images)
+            _products[product_id] = product
+        _products.move_to_end(product_id)
+        while len(_products) > DRAFT_MAX_ENTRIES:
+            _products.popitem(last=False)
+        return product
+
+@dataclass(slots=True)
+class Draft:
+    original: str
+    converted: str
+    chat_id: int
+    product: Product
+    affiliate_link: str
+    # The image the post goes out with, and the one the forwarded message came with
+    photo: Optional[str] = None
+    forwarded_photo: Optional[str] = None
+    message_ids: list = field(default_factory=list)
+    dedupe_keys: tuple = ()
+    # The bot's reply carrying the draft keyboard; also listed in message_ids
+    reply_message_id: Optional[int] = None
+
+    @property
+    def product_id(self):
+        return self.product.product_id
+
+    @property
+    def image_options(self):
+        # The product's images, then the forwarded photo; selection callbacks index into this
+        if self.forwarded_photo:
+            return self.product.small_images + (self.forwarded_photo,)
+        return self.product.small_images
+
+    def copy(self):
+        # The product is immutable and shared; only the message list needs its own copy
+        return replace(self, message_ids=list(self.message_ids))
+
+    def to_dict(self):
+        return {
+            'original': self.original,
+            'converted': self.converted,
+            'chat_id': self.chat_id,
+            'product': {
+                'product_id': self.product.product_id,
+                'title': self.product.title,
+                'small_images': list(self.product.small_images),
+            },
+            'affiliate_link': self.affiliate_link,
+            'photo': self.photo,
+            'forwarded_photo': self.forwarded_photo,
+            'message_ids': self.message_ids,
+            'dedupe_keys': list(self.dedupe_keys),
+            'reply_message_id': self.reply_message_id,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        product = data.get('product')
+        if product is None:
+            # Rows written before drafts had a model: flat product fields, forwarded photo already in the images
+            product = {'product_id': data['product_id'], 'title': data['product_title'], 'small_images': data.get('small_images', [])}
+        return cls(
+            original=data['original'],
+            converted=data['converted'],
+            chat_id=data['chat_id'],
+            product=intern_product(product['product_id'], product['title'], product['small_images']),
+            affiliate_link=data['affiliate_link'],
+            photo=data.get('photo'),
+            forwarded_photo=data.get('forwarded_photo'),
+            message_ids=list(data.get('message_ids', [])),
+            dedupe_keys=tuple(data.get('dedupe_keys', ())),
+            reply_message_id=data.get('reply_message_id'),
+        )
+
+# Drafts are keyed by (chat_id, message_id) of the forwarded message. Stores hand
+# out copies; a change to an existing draft goes through update(), which applies
+# it to the stored draft under the store's lock so concurrent handlers can't
+# overwrite each other's changes with a stale copy.
+
+class MemoryDraftStore:
+    def __init__(self, ttl=DRAFT_TTL, max_entries=DRAFT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evicted = 0
+        self._drafts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chat_id, message_id):
+        key = (chat_id, message_id)
+        with self._lock:
+            entry = self._drafts.get(key)
+            if entry is None:
+                return None
+            draft, expires_at = entry
+            if expires_at <= time.time():
+                del self._drafts[key]
+                return None
+            return draft.copy()
+
+    def put(self, chat_id, message_id, draft):
+        key = (chat_id, message_id)
+        with self._lock:
+            self._drafts[key] = (draft.copy(), time.time() + self.ttl)
+            self._drafts.move_to_end(key)
+            self._evict()
+
+    def update(self, chat_id, message_id, change):
+        # change(draft) edits the draft in place; returns a copy of the result, or None if there's no draft
+        key = (chat_id, message_id)
+        with self._lock:
+            entry = self._drafts.get(key)
+            if entry is None or entry[1] <= time.time():
+                return None
+            draft = entry[0].copy()
+            change(draft)
+            self._drafts[key] = (draft, time.time() + self.ttl)
+            self._drafts.move_to_end(key)
+            return draft.copy()
+
+    def pop(self, chat_id, message_id):
+        with self._lock:
+            entry = self._drafts.pop((chat_id, message_id), None)
+        return entry[0] if entry else None
+
+    def __len__(self):
+        return len(self._drafts)
+
+    def _evict(self):
+        now = time.time()
+        # Entries are in last-write order, so expired ones collect at the front
+        while self._drafts:
+            key, (_, expires_at) = next(iter(self._drafts.items()))
+            if expires_at > now and len(self._drafts) <= self.max_entries:
+                break
+            del self._drafts[key]
+            self.evicted += 1
+
+class SqliteDraftStore:
+    def __init__(self, path=DRAFT_DB_PATH, ttl=DRAFT_TTL, max_entries=DRAFT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evicted = 0
+        self._lock = threading.Lock()
+        ensure_parent_dir(path)
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS drafts (chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL, "
+            "data TEXT NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (chat_id, message_id))"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS drafts_expires_at ON drafts (expires_at)")
+        self._connection.commit()
+
+    def get(self, chat_id, message_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM drafts WHERE chat_id = ? AND message_id = ? AND expires_at > ?",
+                (chat_id, message_id, time.time())
+            ).fetchone()
+        return Draft.from_dict(json.loads(row[0])) if row else None
+
+    def put(self, chat_id, message_id, draft):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO drafts (chat_id, message_id, data, expires_at) VALUES (?, ?, ?, ?)",
+                (chat_id, message_id, json.dumps(draft.to_dict()), time.time() + self.ttl)
+            )
+            self._evict()
+            self._connection.commit()
+
+    def update(self, chat_id, message_id, change):
+        with self._lock:
+            # Taken before the read so another process can't write the draft in between
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute(
+                    "SELECT data FROM drafts WHERE chat_id = ? AND message_id = ? AND expires_at > ?",
+                    (chat_id, message_id, time.time())
+                ).fetchone()
+                if row is None:
+                    self._connection.rollback()
+                    return None
+                draft = Draft.from_dict(json.loads(row[0]))
+                change(draft)
+                self._connection.execute(
+                    "UPDATE drafts SET data = ?, expires_at = ? WHERE chat_id = ? AND message_id = ?",
+                    (json.dumps(draft.to_dict()), time.time() + self.ttl, chat_id, message_id)
+                )
+                self._connection.commit()
+            except BaseException:
+                self._connection.rollback()
+                raise
+        return draft
+
+    def pop(self, chat_id, message_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM drafts WHERE chat_id = ? AND message_id = ?", (chat_id, message_id)
+            ).fetchone()
+            self._connection.execute(
+                "DELETE FROM drafts WHERE chat_id = ? AND message_id = ?", (chat_id, message_id)
+            )
+            self._connection.commit()
+        return Draft.from_dict(json.loads(row[0])) if row else None
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM drafts").fetchone()[0]
+
+    def _evict(self):
+        cursor = self._connection.execute("DELETE FROM drafts WHERE expires_at <= ?", (time.time(),))
+        self.evicted += cursor.rowcount
+        cursor = self._connection.execute(
+            "DELETE FROM drafts WHERE rowid NOT IN "
+            "(SELECT rowid FROM drafts ORDER BY expires_at DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+        self.evicted += cursor.rowcount
+
+def create_draft_store(backend=DRAFT_STORE_BACKEND):
+    if backend == 'sqlite':
+        return SqliteDraftStore()
+    if backend == 'memory':
+        return MemoryDraftStore()
+    raise ValueError(f"Unknown draft store backend: {backend}")
+
+drafts = create_draft_store()
@@ -0,0 +1,238 @@
+## github_sync.py
+
+import asyncio
+import base64
+import logging
+import threading
+import time
+from metrics import increment, timed
+from config import (GIT_TOKEN, GITHUB_REPOSITORY, GITHUB_API_URL, GITHUB_BRANCH, HTTP_TIMEOUT,
+                    GITHUB_SYNC_DEBOUNCE, GITHUB_SYNC_MAX_DELAY, GITHUB_SYNC_RETRIES, GITHUB_SYNC_MAX_BACKOFF)
+
+logger = logging.getLogger(__name__)
+
+# Bytes encoded per step when streaming a blob; a multiple of 3 keeps base64 chunks joinable
+BASE64_CHUNK_SIZE = 3 * 16 * 1024
+
+class GitHubSyncError(Exception):
+    pass
+
+class GitHubConflict(GitHubSyncError):
+    pass
+
+# Collects file changes and pushes them together as a single commit through the
+# Git Data API (blobs -> tree -> commit -> ref), debounced so that several
+# publishes within a few seconds end up in one commit. A failed push keeps its
+# files staged and is retried with backoff until it goes through.
+class GitHubSync:
+    def __init__(self, repository, token, branch='main', api_url='https://api.github.com',
+                 debounce=5, max_delay=30, retries=3, max_backoff=300):
+        self.repository = repository
+        self.branch = branch
+        self.api_url = api_url.rstrip('/')
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.retries = retries
+        self.max_backoff = max_backoff
+        self.commits_pushed = 0
+        self.files_pushed = 0
+        self.conflicts = 0
+        self.failed_pushes = 0
+        self.token = token
+        self._session = None
+        self._pending = {}
+        # path -> callbacks to run once that file is in a pushed commit
+        self._on_pushed = {}
+        self._failures = 0
+        self._pending_lock = threading.Lock()
+        self._head_sha = None
+        self._tree_sha = None
+        self._timer = None
+        self._first_staged_at = None
+        self._flush_lock = None
+        self._flush_task = None
+
+    def raw_url(self, path):
+        return f"https://raw.githubusercontent.com/{self.repository}/{self.branch}/{path}"
+
+    def stage(self, path, content, on_pushed=None):
+        # content is bytes/str, or a function returning them that is called when
+        # the push happens, for files rebuilt from state other workers also change.
+        # raw_url(path) only resolves after the push, so anything that records
+        # the URL for later reuse belongs in on_pushed
+        with self._pending_lock:
+            self._pending[path] = content
+            if on_pushed is not None:
+                self._on_pushed.setdefault(path, []).append(on_pushed)
+
+    def pending_count(self):
+        with self._pending_lock:
+            return len(self._pending)
+
+    async def schedule(self, path, content, on_pushed=None):
+        self.stage(path, content, on_pushed)
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._first_staged_at is None:
+            self._first_staged_at = now
+        if self._timer is not None:
+            self._timer.cancel()
+        # Keep pushing the commit back while publishes keep coming, up to max_delay
+        delay = max(0, min(self.debounce, self._first_staged_at + self.max_delay - now))
+        self._timer = loop.call_later(delay, self._start_flush)
+
+    def _start_flush(self):
+        self._timer = None
+        self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._first_staged_at = None
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            await asyncio.to_thread(self.push_pending)
+        if self._failures and self._timer is None and self.pending_count():
+            # Don't leave the files waiting for the next publish; back off while GitHub keeps failing
+            delay = min(self.debounce * 2 ** self._failures, self.max_backoff)
+            logger.warning("Retrying the GitHub push of %s files in %.0fs", self.pending_count(), delay)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._start_flush)
+
+    def push_pending(self, message=None):
+        with self._pending_lock:
+            files, self._pending = self._pending, {}
+            callbacks, self._on_pushed = self._on_pushed, {}
+        if not files:
+            return None
+        try:
+            with timed('github_push'):
+                commit_sha = self.commit_files(files, message)
+        except Exception as e:
+            self._failures += 1
+            self.failed_pushes += 1
+            logger.error("Failed to push %s files to GitHub: %s", len(files), e)
+            # Put them back for the next flush unless a newer version was staged meanwhile
+            with self._pending_lock:
+                for path, content in files.items():
+                    self._pending.setdefault(path, content)
+                for path, path_callbacks in callbacks.items():
+                    self._on_pushed[path] = path_callbacks + self._on_pushed.get(path, [])
+            return None
+
+        self._failures = 0
+        for path, path_callbacks in callbacks.items():
+            for callback in path_callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error("Callback after pushing %s failed: %s", path, e)
+        return commit_sha
+
+    def commit_files(self, files, message=None):
+        message = message or f"Update {', '.join(sorted(files))}"
+        blobs = {path: self._create_blob(content() if callable(content) else content) for path, content in files.items()}
+
+        for attempt in range(self.retries + 1):
+            try:
+                if self._head_sha is None:
+                    self._load_head()
+                tree_sha = self._create_tree(blobs)
+                commit_sha = self._create_commit(message, tree_sha)
+                self._update_ref(commit_sha)
+            except GitHubConflict:
+                # Someone else moved the branch; rebuild on top of the new head
+                self.conflicts += 1
+                self._head_sha = None
+                if attempt == self.retries:
+                    raise
+                time.sleep(0.5 * (attempt + 1))
+                # The other commit may come from another worker, so files built at
+                # push time are built again rather than committing an older version
+                blobs.update({path: self._create_blob(content()) for path, content in files.items() if callable(content)})
+                continue
+            self._head_sha, self._tree_sha = commit_sha, tree_sha
+            self.commits_pushed += 1
+            self.files_pushed += len(files)
+            logger.info("Pushed %s files to GitHub in commit %s", len(files), commit_sha[:7])
+            return commit_sha
+
+    def stats(self):
+        return {
+            'pending_files': self.pending_count(),
+            'commits_pushed': self.commits_pushed,
+            'files_pushed': self.files_pushed,
+            'conflicts': self.conflicts,
+            'failed_pushes': self.failed_pushes,
+        }
+
+    @property
+    def session(self):
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+            self._session.headers.update({
+                "Authorization": f"token {self.token}",
+                "Accept": "application/vnd.github.v3+json"
+            })
+        return self._session
+
+    def _request(self, method, path, **kwargs):
+        url = f"{self.api_url}/repos/{self.repository}/git/{path}"
+        response = self.session.request(method, url, timeout=HTTP_TIMEOUT, **kwargs)
+        if response.status_code in (409, 422) and path.startswith('refs/'):
+            raise GitHubConflict(f"{method} {path}: {response.status_code}")
+        if response.status_code >= 400:
+            raise GitHubSyncError(f"{method} {path}: {response.status_code} {response.text[:200]}")
+        return response.json()
+
+    def _load_head(self):
+        ref = self._request('GET', f"ref/heads/{self.branch}")
+        self._head_sha = ref['object']['sha']
+        commit = self._request('GET', f"commits/{self._head_sha}")
+        self._tree_sha = commit['tree']['sha']
+
+    def _create_blob(self, content):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        blob = self._request('POST', 'blobs', data=self._blob_body(content),
+                             headers={"Content-Type": "application/json"})
+        increment('github_bytes_uploaded', len(content))
+        return blob['sha']
+
+    @staticmethod
+    def _blob_body(content):
+        # Stream the JSON body so the base64 copy of an image never exists in full
+        view = memoryview(content)
+        yield b'{"encoding": "base64", "content": "'
+        for start in range(0, len(view), BASE64_CHUNK_SIZE):
+            yield base64.b64encode(view[start:start + BASE64_CHUNK_SIZE])
+        yield b'"}'
+
+    def _create_tree(self, blobs):
+        tree = self._request('POST', 'trees', json={
+            "base_tree": self._tree_sha,
+            "tree": [
+                {"path": path, "mode": "100644", "type": "blob", "sha": sha}
+                for path, sha in blobs.items()
+            ]
+        })
+        return tree['sha']
+
+    def _create_commit(self, message, tree_sha):
+        commit = self._request('POST', 'commits', json={
+            "message": message,
+            "tree": tree_sha,
+            "parents": [self._head_sha]
+        })
+        return commit['sha']
+
+    def _update_ref(self, commit_sha):
+        self._request('PATCH', f"refs/heads/{self.branch}", json={"sha": commit_sha})
+
+github_sync = GitHubSync(
+    GITHUB_REPOSITORY, GIT_TOKEN, branch=GITHUB_BRANCH, api_url=GITHUB_API_URL,
+    debounce=GITHUB_SYNC_DEBOUNCE, max_delay=GITHUB_SYNC_MAX_DELAY, retries=GITHUB_SYNC_RETRIES,
+    max_backoff=GITHUB_SYNC_MAX_BACKOFF
+)
@@ -1,209 +1,240 @@
 import logging
-import base64
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+import time
+from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-from affiliate_converter import convert_affiliate_links, generate_affiliate_link
-from rss_feed_generator import add_to_rss_feed
-from utils import update_github_file, temporary_storage, download_image, upload_to_github
-from aliexpress_scraper import fetch_aliexpress_product_details
-import re
-from handlers_img import handle_image_selection, replace_image
+from draft_store import drafts, Draft, intern_product
+from utils import delete_messages
+from services import convert_affiliate_links_async, generate_affiliate_link_async, fetch_product_details_async, run_blocking
+from publish_queue import publish_queue, add_to_feed, send_post, next_slot_time
+from metrics import track_api_calls, timed, increment
+from dedupe import deal_keys, claim, remember, forget
+from link_parser import parse_links, ALIEXPRESS_KINDS
+from config import ALIEXPRESS_TRACKING_ID, STATS_ADMIN_IDS, SERVICE_TIMEOUT, DEFER_CLEANUP
+from handlers_img import replace_image
+from callbacks import router, keyboard, draft_keyboard, CONFIRM_PUBLISH_KEYBOARD, CONFIRM_CANCEL_KEYBOARD
 
 logger = logging.getLogger(__name__)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text('Hello! I am your promotion bot.')
 
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Imported here: stats pulls in every subsystem it reports on
+    from stats import collect_stats, format_stats
+
+    if update.effective_user is None or update.effective_user.id not in STATS_ADMIN_IDS:
+        logger.info("Ignoring /stats from user %s, not in STATS_ADMIN_IDS", update.effective_user and update.effective_user.id)
+        return
+    await update.message.reply_text(format_stats(collect_stats()))
+
 async def handle_forwarded_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.message
     content = message.caption if message.caption else message.text
 
     if content:
-        logger.info(f"Received forwarded message: {content}")
-
-        url_pattern = re.compile(r'https?://[^\s]+')
-        url_match = url_pattern.search(content)
-        if not url_match:
-            logger.error("No URL found in the message.")
-            return
-
-        url = url_match.group(0)
-
-        affiliate_link = generate_affiliate_link(url)
-        if not affiliate_link:
-            logger.error("Failed to generate affiliate link.")
-            return
-
-        product_details = fetch_aliexpress_product_details(url)
-
-        if product_details:
-            product_id = product_details.get('product_id')
-            product_title = product_details.get('product_title')
-            small_images = product_details.get('product_small_image_urls', [])
-
-            if not product_id or not product_title:
-                logger.error("Incomplete product details received from AliExpress.")
-                return
-
-            if message.photo:
-                telegram_photo_id = message.photo[-1].file_id
-                small_images.append(telegram_photo_id)
-                logger.info(f"Telegram Photo ID: {telegram_photo_id}")
-
-            logger.info(f"Product ID: {product_id}")
-            logger.info(f"Product Title: {product_title}")
-            logger.info(f"Product Small Images: {small_images}")
-            logger.info(f"Affiliate Link: {affiliate_link}")
-
-            temporary_storage[message.message_id] = {
-                'original': content,
-                'converted': convert_affiliate_links(content),
-                'photo': telegram_photo_id if message.photo else None,
-                'chat_id': message.chat_id,
-                'message_ids': [message.message_id],
-                'product_id': product_id,
-                'product_title': product_title,
-                'small_images': small_images,
-                'affiliate_link': affiliate_link
-            }
-
-            keyboard = [
-                [InlineKeyboardButton("Replace Image", callback_data=f"replace_image:{message.message_id}")],
-                [InlineKeyboardButton("Edit Text", callback_data=f"edit_text:{message.message_id}")],
-                [InlineKeyboardButton("Publish", callback_data=f"publish:{message.message_id}")],
-                [InlineKeyboardButton("Cancel", callback_data=f"cancel:{message.message_id}")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            if message.photo:
-                sent_message = await message.reply_photo(
-                    message.photo[-1].file_id,
-                    caption=f"{convert_affiliate_links(content)}",
-                    reply_markup=reply_markup
-                )
-            else:
-                sent_message = await message.reply_text(
-                    text=f"{convert_affiliate_links(content)}",
-                    reply_markup=reply_markup
-                )
-        
-            temporary_storage[message.message_id]['message_ids'].append(sent_message.message_id)
+        logger.debug("Received forwarded message: %s", content)
+        with track_api_calls() as api_calls, timed('forwarded_message'):
+            await process_forwarded_message(message, content)
+        logger.info("Processed message %s, external API calls: %s", message.message_id, dict(api_calls))
+
+async def process_forwarded_message(message, content) -> None:
+    links = parse_links(content, ALIEXPRESS_TRACKING_ID)
+    if not links:
+        logger.error("No URL found in the message.")
+        return
+
+    # The promo's product link: the first AliExpress link, else whatever link comes first
+    url = next((link.url for link in links if link.kind in ALIEXPRESS_KINDS), links[0].url)
+
+    # Checked before any API call; the keys are claimed now so a copy arriving
+    # while this one is still being processed is caught too
+    dedupe_keys = await run_blocking(deal_keys, content, links, url) or []
+    duplicate = await run_blocking(claim, dedupe_keys, message.chat_id, message.message_id, still_open)
+    if duplicate:
+        increment('duplicate_promos')
+        logger.info("Skipping duplicate deal in message %s (%s)", message.message_id, duplicate['state'])
+        await message.reply_text(f"This deal was already {duplicate['state']} recently, skipping it.")
+        return
+
+    draft = None
+    try:
+        draft = await create_draft(message, content, links, url)
+    finally:
+        if draft is None:
+            await run_blocking(forget, dedupe_keys)
+        else:
+            draft.dedupe_keys = tuple(dedupe_keys)
+            drafts.put(message.chat_id, message.message_id, draft)
+
+def still_open(record):
+    # A draft that expired or was cancelled elsewhere no longer blocks the deal; one still being built does
+    if record['state'] != 'draft':
+        return True
+    return drafts.get(record['chat_id'], record['message_id']) is not None or time.time() - record['seen_at'] < SERVICE_TIMEOUT
+
+async def create_draft(message, content, links, url):
+    # Every link in the message is converted once here and the result is reused below
+    converted, affiliate_links = await convert_affiliate_links_async(content, links)
+    affiliate_link = affiliate_links.get(url) or await generate_affiliate_link_async(url)
+    if not affiliate_link:
+        logger.error("Failed to generate affiliate link.")
+        return None
+
+    product_details = await fetch_product_details_async(url)
+
+    if product_details:
+        product_id = product_details.get('product_id')
+        product_title = product_details.get('product_title')
+
+        if not product_id or not product_title:
+            logger.error("Incomplete product details received from AliExpress.")
+            return None
+
+        telegram_photo_id = message.photo[-1].file_id if message.photo else None
+        logger.debug("Telegram Photo ID: %s", telegram_photo_id)
+
+        draft = Draft(
+            original=content,
+            converted=converted,
+            chat_id=message.chat_id,
+            product=intern_product(product_id, product_title, product_details.get('small_image_urls', ())),
+            affiliate_link=affiliate_link,
+            photo=telegram_photo_id,
+            forwarded_photo=telegram_photo_id,
+            message_ids=[message.message_id]
+        )
+        logger.info("Product %s: %s (%s images)", product_id, product_title, len(draft.image_options))
+        logger.debug("Product Small Images: %s", draft.image_options)
+        logger.debug("Affiliate Link: %s", affiliate_link)
+
+        reply_markup = draft_keyboard(message.chat_id, message.message_id)
+
+        if message.photo:
+            sent_message = await message.reply_photo(
+                message.photo[-1].file_id,
+                caption=converted,
+                reply_markup=reply_markup
+            )
         else:
-            logger.error("Failed to fetch product details from AliExpress.")
-
-async def handle_button_click(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    await query.answer()
-    data = query.data
-    parts = data.split(":")
-    command, message_id = parts[0], int(parts[1])
-    
-    logger.info(f"Button click received: {command}, message_id: {message_id}")
-
-    if command == "replace_image":
-        await replace_image(update, context, message_id)
-    elif command == "edit_text":
-        await query.message.reply_text(text="Please send the new text for the message.")
-        context.user_data['editing_message_id'] = message_id
-    elif command == "publish":
-        keyboard = [
-            [InlineKeyboardButton("Yes", callback_data=f"confirm_publish:{message_id}")],
-            [InlineKeyboardButton("No", callback_data=f"deny_publish:{message_id}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        sent_message = await query.message.reply_text(text="Are you sure you want to publish this message?", reply_markup=reply_markup)
-        temporary_storage[message_id]['message_ids'].append(sent_message.message_id)
-    elif command == "cancel":
-        keyboard = [
-            [InlineKeyboardButton("Yes", callback_data=f"confirm_cancel:{message_id}")],
-            [InlineKeyboardButton("No", callback_data=f"deny_cancel:{message_id}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        sent_message = await query.message.reply_text(text="Are you sure you want to cancel? This will delete all related messages.", reply_markup=reply_markup)
-        temporary_storage[message_id]['message_ids'].append(sent_message.message_id)
-    elif command == "confirm_publish":
-        await confirm_publish(update, context, message_id)
-    elif command == "deny_publish":
-        await query.message.delete()
-    elif command == "confirm_cancel":
-        await confirm_cancel(update, context, message_id)
-    elif command == "deny_cancel":
-        await query.message.delete()
-        original_message_id = temporary_storage[message_id]['message_ids'][-2]
+            sent_message = await message.reply_text(
+                text=converted,
+                reply_markup=reply_markup
+            )
+
+        draft.message_ids.append(sent_message.message_id)
+        draft.reply_message_id = sent_message.message_id
+        return draft
+    else:
+        logger.error("Failed to fetch product details from AliExpress.")
+        return None
+
+@router.route('replace_image')
+async def on_replace_image(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int) -> None:
+    await replace_image(update, context, message_id)
+
+@router.route('edit_text')
+async def on_edit_text(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int) -> None:
+    await update.callback_query.message.reply_text(text="Please send the new text for the message.")
+    context.user_data['editing_draft'] = (chat_id, message_id)
+
+@router.route('publish')
+async def on_publish(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int) -> None:
+    reply_markup = keyboard(CONFIRM_PUBLISH_KEYBOARD, chat_id, message_id)
+    sent_message = await update.callback_query.message.reply_text(text="Are you sure you want to publish this message?", reply_markup=reply_markup)
+    track_draft_message(chat_id, message_id, sent_message.message_id)
+
+@router.route('cancel')
+async def on_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int) -> None:
+    reply_markup = keyboard(CONFIRM_CANCEL_KEYBOARD, chat_id, message_id)
+    sent_message = await update.callback_query.message.reply_text(text="Are you sure you want to cancel? This will delete all related messages.", reply_markup=reply_markup)
+    track_draft_message(chat_id, message_id, sent_message.message_id)
+
+@router.route('confirm_publish')
+async def on_confirm_publish(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int) -> None:
+    await confirm_publish(update, context, message_id)
+
+@router.route('deny_publish')
+async def on_deny_publish(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int) -> None:
+    await update.callback_query.message.delete()
+
+@router.route('confirm_cancel')
+async def on_confirm_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int) -> None:
+    await confirm_cancel(update, context, message_id)
+
+@router.route('deny_cancel')
+async def on_deny_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int) -> None:
+    await update.callback_query.message.delete()
+    draft = drafts.get(chat_id, message_id)
+    if not draft or draft.reply_message_id is None:
+        return
+    try:
         await context.bot.edit_message_reply_markup(
-            chat_id=query.message.chat_id, 
-            message_id=original_message_id, 
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Replace Image", callback_data=f"replace_image:{message_id}")],
-                [InlineKeyboardButton("Edit Text", callback_data=f"edit_text:{message_id}")],
-                [InlineKeyboardButton("Publish", callback_data=f"publish:{message_id}")],
-                [InlineKeyboardButton("Cancel", callback_data=f"cancel:{message_id}")]
-            ])
+            chat_id=chat_id,
+            message_id=draft.reply_message_id,
+            reply_markup=draft_keyboard(chat_id, message_id)
         )
+    except BadRequest as e:
+        # Usually "message is not modified": the reply still shows the draft keyboard
+        logger.debug("Draft keyboard of message %s left as it is: %s", draft.reply_message_id, e)
+
+def track_draft_message(chat_id, message_id, sent_message_id):
+    drafts.update(chat_id, message_id, lambda draft: draft.message_ids.append(sent_message_id))
 
 async def receive_new_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if 'editing_message_id' in context.user_data:
-        message_id = context.user_data['editing_message_id']
+    if 'editing_draft' in context.user_data:
+        chat_id, message_id = context.user_data['editing_draft']
         new_text = update.message.text
-        if message_id in temporary_storage:
-            temporary_storage[message_id]['converted'] = new_text
+        if drafts.update(chat_id, message_id, lambda draft: setattr(draft, 'converted', new_text)):
             await update.message.reply_text('Text updated. Use Publish to publish the final message or Cancel to cancel it.')
 
 async def confirm_publish(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id: int) -> None:
-    if message_id in temporary_storage:
-        chat_id = temporary_storage[message_id]['chat_id']
-        content = temporary_storage[message_id]['converted']
-        original_content = temporary_storage[message_id]['original']
-        photo_id = temporary_storage[message_id]['photo']
-        product_id = temporary_storage[message_id]['product_id']
-
-        image_url = None
-        if photo_id:
-            file_path = await download_image(context, photo_id, f"{product_id}-01.jpg")
-            image_url = upload_to_github(file_path, f"{product_id}-01.jpg")
-
-        add_to_rss_feed(
-            content=content,
-            title=original_content[:30] if len(original_content) > 30 else None,
-            description=content,
-            image_url=image_url
-        )
-        
-        with open('rss-feed_promo.xml', 'r', encoding='utf-8') as file:
-            rss_feed_content = file.read()
-        
-        rss_feed_content_base64 = base64.b64encode(rss_feed_content.encode('utf-8')).decode('utf-8')
-        update_github_file(rss_feed_content_base64)
-        
+    draft = drafts.pop(update.effective_chat.id, message_id)
+    if draft:
+        chat_id = draft.chat_id
         bot = context.bot
-        if photo_id:
-            await bot.send_photo(chat_id=chat_id, photo=photo_id, caption=content)
-        else:
-            await bot.send_message(chat_id=chat_id, text=content)
-        
-        message_ids = temporary_storage[message_id]['message_ids']
-        for msg_id in message_ids:
+
+        try:
+            if publish_queue is not None:
+                position = publish_queue.enqueue(draft)
+            else:
+                await send_post(bot, draft)
+        except Exception:
+            # The deal didn't go out: the draft is kept so Publish can be pressed again, and still holds the deal
+            drafts.put(chat_id, message_id, draft)
+            await run_blocking(remember, draft.dedupe_keys, 'draft', chat_id, message_id)
+            raise
+        await run_blocking(remember, draft.dedupe_keys, 'published', chat_id, message_id)
+        if publish_queue is None:
+            # Added only once the post is out, so a retried Publish never puts the deal in the feed twice
             try:
-                await bot.delete_message(chat_id=chat_id, message_id=msg_id)
+                await add_to_feed(bot, [draft])
             except Exception as e:
-                logger.error(f"Failed to delete message {msg_id}: {e}")
-        del temporary_storage[message_id]
-        await bot.send_message(chat_id, text='Message published and all related messages have been deleted.')
+                logger.error("Published the deal from message %s, but adding it to the feed failed: %s", message_id, e)
+
+        await delete_messages(bot, chat_id, draft.message_ids)
+        if publish_queue is not None:
+            next_slot = time.strftime('%H:%M', time.localtime(next_slot_time()))
+            await bot.send_message(chat_id, text=f'Message scheduled for publishing: position {position} in the queue, next slot at {next_slot}.')
+        else:
+            await bot.send_message(chat_id, text=f'Message published and {cleanup_status()}.')
 
 async def confirm_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id: int) -> None:
-    if message_id in temporary_storage:
-        chat_id = temporary_storage[message_id]['chat_id']
-        message_ids = temporary_storage[message_id]['message_ids']
-        for msg_id in message_ids:
-            try:
-                await context.bot.delete_message(chat_id=chat_id, message_id=msg_id)
-            except Exception as e:
-                logger.error(f"Failed to delete message {msg_id}: {e}")
-        del temporary_storage[message_id]
-        await context.bot.send_message(chat_id, text='All related messages have been deleted.')
+    draft = drafts.pop(update.effective_chat.id, message_id)
+    if draft:
+        chat_id = draft.chat_id
+        await run_blocking(forget, draft.dedupe_keys)
+        await delete_messages(context.bot, chat_id, draft.message_ids)
+        await context.bot.send_message(chat_id, text=f'Draft cancelled and {cleanup_status()}.')
+
+def cleanup_status():
+    # Deferred deletes are still running when the confirmation goes out
+    return 'the related messages are being deleted' if DEFER_CLEANUP else 'all related messages have been deleted'
 
 def register_handlers(application):
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("stats", stats))
     application.add_handler(MessageHandler(filters.FORWARDED, handle_forwarded_message))
-    application.add_handler(CallbackQueryHandler(handle_button_click))
+    # Every button goes through the router; handlers_img registers the image selection commands
+    application.add_handler(CallbackQueryHandler(router.dispatch))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, receive_new_text))
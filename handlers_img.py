@@ -1,84 +1,152 @@
+import asyncio
 import logging
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+import time
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto
 from telegram.ext import ContextTypes
-from utils import temporary_storage  # Add this line to import temporary_storage
+from config import REPLACE_IMAGE_MODE, REPLACE_IMAGE_CONCURRENCY
+from draft_store import drafts
+from utils import delete_messages
+from callbacks import router, encode, draft_keyboard
 
 logger = logging.getLogger(__name__)
 
+# Telegram accepts at most this many photos in one media group
+MEDIA_GROUP_LIMIT = 10
+
 async def replace_image(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id: int) -> None:
-    if message_id in temporary_storage:
-        small_images = temporary_storage[message_id].get('small_images', [])
-        current_photo = temporary_storage[message_id].get('photo')
-        logger.info(f"Current photo: {current_photo}")
-        for idx, img_id in enumerate(small_images):
-            if img_id != current_photo:
-                callback_data_select = f"select_image:{message_id}:{idx}"
-                callback_data_remove = f"remove_image:{message_id}:{idx}"
-
-                keyboard = [
-                    [InlineKeyboardButton("✅", callback_data=callback_data_select), InlineKeyboardButton("❌", callback_data=callback_data_remove)]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                try:
-                    await update.callback_query.message.reply_photo(photo=img_id, reply_markup=reply_markup)
-                    logger.info(f"Displayed image option: {img_id}")
-                except Exception as e:
-                    logger.error(f"Error displaying image option {img_id}: {e}")
-
-async def handle_image_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = update.effective_chat.id
+    draft = drafts.get(chat_id, message_id)
+    if draft:
+        small_images = draft.image_options
+        current_photo = draft.photo
+        logger.info("Current photo: %s", current_photo)
+        candidates = [(idx, img_id) for idx, img_id in enumerate(small_images) if img_id != current_photo]
+        if not candidates:
+            return
+
+        started = time.perf_counter()
+        message = update.callback_query.message
+        sent_ids = None
+        if REPLACE_IMAGE_MODE == 'album':
+            sent_ids = await send_image_album(message, message_id, candidates)
+        if sent_ids is None:
+            sent_ids = await send_image_options(message, message_id, candidates)
+        logger.info("Displayed %s image options in %.2fs", len(candidates), time.perf_counter() - started)
+
+        # Track the option messages so publish/cancel cleans them up with the draft
+        if sent_ids:
+            drafts.update(chat_id, message_id, lambda draft: draft.message_ids.extend(sent_ids))
+
+async def send_image_album(message, message_id, candidates):
+    # One media group per 10 images and a single numbered selection keyboard
+    sent_ids = []
+    try:
+        for start in range(0, len(candidates), MEDIA_GROUP_LIMIT):
+            chunk = candidates[start:start + MEDIA_GROUP_LIMIT]
+            sent = await message.reply_media_group(media=[InputMediaPhoto(img_id) for _, img_id in chunk])
+            sent_ids.extend(sent_message.message_id for sent_message in sent)
+    except Exception as e:
+        logger.error("Error sending image album, falling back to single images: %s", e)
+        return None
+
+    # Each album photo is its own message, so ❌ carries the one it removes
+    keyboard = [
+        [InlineKeyboardButton(f"✅ {number}", callback_data=encode('select_image', message.chat_id, message_id, idx)),
+         InlineKeyboardButton(f"❌ {number}", callback_data=encode('remove_image', message.chat_id, message_id, idx, option_id))]
+        for number, ((idx, _), option_id) in enumerate(zip(candidates, sent_ids), start=1)
+    ]
+    selection = await message.reply_text("Pick the image to use:", reply_markup=InlineKeyboardMarkup(keyboard))
+    sent_ids.append(selection.message_id)
+    return sent_ids
+
+async def send_image_options(message, message_id, candidates):
+    semaphore = asyncio.Semaphore(REPLACE_IMAGE_CONCURRENCY)
+
+    async def send_option(idx, img_id):
+        callback_data_select = encode('select_image', message.chat_id, message_id, idx)
+        callback_data_remove = encode('remove_image', message.chat_id, message_id, idx)
+
+        keyboard = [
+            [InlineKeyboardButton("✅", callback_data=callback_data_select), InlineKeyboardButton("❌", callback_data=callback_data_remove)]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        async with semaphore:
+            try:
+                sent_message = await message.reply_photo(photo=img_id, reply_markup=reply_markup)
+                logger.info("Displayed image option: %s", img_id)
+                return sent_message.message_id
+            except Exception as e:
+                logger.error("Error displaying image option %s: %s", img_id, e)
+                return None
+
+    sent_ids = await asyncio.gather(*(send_option(idx, img_id) for idx, img_id in candidates))
+    return [sent_id for sent_id in sent_ids if sent_id is not None]
+
+@router.route('select_image')
+async def select_image(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, img_idx: int) -> None:
+    def use_image(draft):
+        draft.photo = draft.image_options[img_idx]
+
+    draft = drafts.update(chat_id, message_id, use_image)
+    if not draft:
+        return
+    logger.info("Selected image: %s", draft.photo)
+    await refresh_main_reply(update, context, message_id)
+
+@router.route('remove_image')
+async def remove_image(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, img_idx: int,
+                       option_id: int = None) -> None:
     query = update.callback_query
-    await query.answer()
-    data = query.data
-    action, message_id, img_idx = data.split(":")
-    message_id = int(message_id)
-    img_idx = int(img_idx)
-
-    logger.info(f"Image selection action: {action}, message_id: {message_id}, img_idx: {img_idx}")
-
-    if action == "select_image":
-        small_images = temporary_storage[message_id]['small_images']
-        selected_image = small_images[img_idx]
-        temporary_storage[message_id]['photo'] = selected_image
-        logger.info(f"Selected image: {selected_image}")
-        await refresh_main_reply(update, context, message_id)
-    elif action == "remove_image":
-        logger.info(f"Removing image message: {query.message.message_id}")
+    if option_id is None:
+        # The option is the message the button sits on
+        option_id = query.message.message_id
+    logger.info("Removing image message: %s", option_id)
+    try:
+        await context.bot.delete_message(chat_id=chat_id, message_id=option_id)
+        logger.info("Image message %s removed successfully.", option_id)
+    except Exception as e:
+        logger.error("Failed to remove image message %s: %s", option_id, e)
+        return
+
+    if option_id != query.message.message_id:
+        # An album photo: drop its row from the selection keyboard, and the keyboard once it's empty
+        rows = [row for row in query.message.reply_markup.inline_keyboard
+                if all(button.callback_data != query.data for button in row)]
         try:
-            await query.message.delete()
-            logger.info(f"Image message {query.message.message_id} removed successfully.")
+            if rows:
+                await query.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(rows))
+            else:
+                await query.message.delete()
         except Exception as e:
-            logger.error(f"Failed to remove image message {query.message.message_id}: {e}")
+            logger.error("Failed to update the image selection keyboard: %s", e)
 
 async def refresh_main_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id: int) -> None:
-    if message_id in temporary_storage:
-        content = temporary_storage[message_id]['converted']
-        chat_id = temporary_storage[message_id]['chat_id']
-        photo = temporary_storage[message_id]['photo']
+    draft = drafts.get(update.effective_chat.id, message_id)
+    if draft:
+        content = draft.converted
+        chat_id = draft.chat_id
+        photo = draft.photo
 
-        keyboard = [
-            [InlineKeyboardButton("Replace Image", callback_data=f"replace_image:{message_id}")],
-            [InlineKeyboardButton("Edit Text", callback_data=f"edit_text:{message_id}")],
-            [InlineKeyboardButton("Publish", callback_data=f"publish:{message_id}")],
-            [InlineKeyboardButton("Cancel", callback_data=f"cancel:{message_id}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = draft_keyboard(chat_id, message_id)
 
         bot = context.bot
-        logger.info(f"Refreshing main reply with new photo: {photo}")
+        logger.info("Refreshing main reply with new photo: %s", photo)
         try:
             if photo:
                 sent_message = await bot.send_photo(chat_id=chat_id, photo=photo, caption=content, reply_markup=reply_markup)
             else:
                 sent_message = await bot.send_message(chat_id=chat_id, text=content, reply_markup=reply_markup)
-            
-            message_ids = temporary_storage[message_id]['message_ids']
-            for msg_id in message_ids:
-                try:
-                    await bot.delete_message(chat_id=chat_id, message_id=msg_id)
-                    logger.info(f"Deleted message with ID: {msg_id}")
-                except Exception as e:
-                    logger.error(f"Failed to delete message {msg_id}: {e}")
-
-            temporary_storage[message_id]['message_ids'] = [sent_message.message_id]
+
+            deleted = set(draft.message_ids)
+            await delete_messages(bot, chat_id, draft.message_ids)
+
+            # Messages tracked by other handlers while these calls ran are kept
+            def replace_messages(stored):
+                stored.message_ids = [sent_message.message_id] + [sent_id for sent_id in stored.message_ids if sent_id not in deleted]
+                stored.reply_message_id = sent_message.message_id
+
+            if drafts.update(chat_id, message_id, replace_messages) is None:
+                # Published or cancelled in the meantime; the new reply has nothing left to belong to
+                await delete_messages(bot, chat_id, [sent_message.message_id])
         except Exception as e:
-            logger.error(f"Error refreshing main reply: {e}")
+            logger.error("Error refreshing main reply: %s", e)
@@ -0,0 +1,69 @@
+## image_processing.py
+
+import asyncio
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from config import IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_PROCESS_WORKERS
+from metrics import increment, timed
+
+logger = logging.getLogger(__name__)
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png', 'GIF': 'image/gif'}
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png', 'GIF': 'gif'}
+
+def sniff_format(content):
+    # The format of an image we couldn't process, from its magic bytes; Pillow isn't loaded in this process
+    header = bytes(content[:12])
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if header.startswith((b'GIF87a', b'GIF89a')):
+        return 'GIF'
+    if header.startswith(b'RIFF') and header[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+_pool = None
+
+def process_image(content, max_width=IMAGE_MAX_WIDTH, max_height=IMAGE_MAX_HEIGHT,
+                  image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY):
+    # Runs in a worker process, so Pillow is only imported there
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_width, max_height))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, format=image_format, quality=quality, optimize=True)
+    return output.getvalue()
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_PROCESS_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+async def process_image_async(content):
+    # Returns (bytes, mime type, extension); falls back to the original image if processing
+    # fails, and to None if that isn't an image format feed readers know either
+    loop = asyncio.get_running_loop()
+    try:
+        with timed('image_processing'):
+            processed = await loop.run_in_executor(_get_pool(), process_image, bytes(content))
+    except Exception as e:
+        original_format = sniff_format(content)
+        if original_format is None:
+            logger.error("Image processing failed and the original isn't a known image format: %s", e)
+            return None
+        logger.error("Image processing failed, publishing the original %s: %s", original_format, e)
+        return content, MIME_TYPES[original_format], EXTENSIONS[original_format]
+
+    increment('image_bytes_before_processing', len(content))
+    increment('image_bytes_after_processing', len(processed))
+    logger.info("Image recompressed from %s to %s bytes", len(content), len(processed))
+    return processed, MIME_TYPES.get(IMAGE_FORMAT, 'image/jpeg'), EXTENSIONS.get(IMAGE_FORMAT, 'jpg')
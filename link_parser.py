@@ -0,0 +1,87 @@
+## link_parser.py
+
+import re
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+# URLs stop at whitespace, quotes and angle brackets, and don't end in punctuation.
+# The host is captured so classification needs no second parse of the URL.
+URL_PATTERN = re.compile(r"https?://([\w.-]*\w)(?:[:/?#][^\s<>\"']*[^\s<>\"'.,;:!?)\]}]|/)?")
+ITEM_URL_PATTERN = re.compile(r'/item/(\d+)\.html')
+# Item pages first; a bare /<id>.html is the fallback for other AliExpress page layouts
+PRODUCT_ID_PATTERN = re.compile(r'/item/(\d+)\.html|/(\d+)\.html')
+
+ALIEXPRESS_ITEM = 'aliexpress_item'
+ALIEXPRESS_SHORT = 'aliexpress_short'
+ALIEXPRESS_AFFILIATE = 'aliexpress_affiliate'
+ALIEXPRESS_OTHER = 'aliexpress_other'
+MARKETPLACE = 'marketplace'
+OTHER = 'other'
+ALIEXPRESS_KINDS = (ALIEXPRESS_ITEM, ALIEXPRESS_SHORT, ALIEXPRESS_AFFILIATE, ALIEXPRESS_OTHER)
+
+SHORT_LINK_HOSTS = {'a.aliexpress.com', 'aliexpi.com'}
+AFFILIATE_HOSTS = {'s.click.aliexpress.com', 'click.aliexpress.com'}
+MARKETPLACE_HOST_PATTERN = re.compile(r'(?:^|\.)(?:amazon|amzn|shopee|mercadolivre|mercadolibre|magazineluiza|shein)\.')
+
+class Link(NamedTuple):
+    url: str
+    start: int
+    end: int
+    kind: str
+    product_id: Optional[str]
+
+def extract_product_id(url):
+    match = PRODUCT_ID_PATTERN.search(url)
+    if match:
+        return match.group(1) or match.group(2)
+    return None
+
+def classify(url, tracking_id=None, host=None):
+    host = (host or urlsplit(url).hostname or '').lower()
+    if 'aliexpress' in host or host in SHORT_LINK_HOSTS:
+        if host in AFFILIATE_HOSTS or (tracking_id and tracking_id in url):
+            return ALIEXPRESS_AFFILIATE, None
+        match = PRODUCT_ID_PATTERN.search(url)
+        if match:
+            return ALIEXPRESS_ITEM, match.group(1) or match.group(2)
+        if host in SHORT_LINK_HOSTS:
+            return ALIEXPRESS_SHORT, None
+        return ALIEXPRESS_OTHER, None
+    if MARKETPLACE_HOST_PATTERN.search(host):
+        return MARKETPLACE, None
+    return OTHER, None
+
+def parse_links(text, tracking_id=None):
+    links = []
+    for match in URL_PATTERN.finditer(text):
+        url = match.group(0)
+        start, end = match.span()
+        links.append(Link(url, start, end, *classify(url, tracking_id, match.group(1))))
+    return links
+
+def is_convertible(link):
+    return link.kind in (ALIEXPRESS_ITEM, ALIEXPRESS_SHORT, ALIEXPRESS_OTHER)
+
+def replace_links(text, links, replacements):
+    # Rebuild the text from slices in one pass using the spans from parse_links
+    parts = []
+    position = 0
+    for link in links:
+        replacement = replacements.get(link.url)
+        if replacement:
+            parts.append(text[position:link.start])
+            parts.append(replacement)
+            position = link.end
+    if not parts:
+        return text
+    parts.append(text[position:])
+    return ''.join(parts)
+
+def normalize_url(url):
+    url = url.strip().rstrip('.,;)')
+    parts = urlsplit(url)
+    query = parts.query
+    # Item pages are fully identified by their path; tracking params only fragment the cache
+    if '/item/' in parts.path:
+        query = ''
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
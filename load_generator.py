@@ -0,0 +1,71 @@
+## load_generator.py
+#
+# Posts synthetic Telegram updates to the webhook dispatcher and reports how
+# many updates per second the workers get through, e.g.
+#   python main.py --webhook --workers 4
+#   python load_generator.py --updates 2000 --chats 50
+
+import argparse
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from config import WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+def synthetic_update(update_id, chat_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}] if text.startswith('/') else [],
+        }
+    }
+
+def post_update(base_url, update):
+    request = urllib.request.Request(
+        f"{base_url}{WEBHOOK_PATH}",
+        data=json.dumps(update).encode('utf-8'),
+        headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET or ''}
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.status
+
+def fetch_stats(base_url):
+    with urllib.request.urlopen(f"{base_url}/stats", timeout=10) as response:
+        return json.loads(response.read())
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator for the webhook dispatcher')
+    parser.add_argument('--url', default=f"http://127.0.0.1:{WEBHOOK_PORT}")
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--chats', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--text', default='/start')
+    args = parser.parse_args()
+
+    processed_before = sum(fetch_stats(args.url)['processed'])
+    updates = [synthetic_update(i + 1, 100000 + i % args.chats, args.text) for i in range(args.updates)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        statuses = list(executor.map(lambda update: post_update(args.url, update), updates))
+    accepted_at = time.perf_counter()
+
+    while sum(fetch_stats(args.url)['processed']) - processed_before < args.updates:
+        time.sleep(0.05)
+    finished = time.perf_counter()
+
+    stats = fetch_stats(args.url)
+    print(f"workers:          {stats['workers']}")
+    print(f"accepted:         {statuses.count(200)}/{args.updates} in {accepted_at - started:.2f}s "
+          f"({args.updates / (accepted_at - started):.0f} updates/s)")
+    print(f"processed:        {args.updates} in {finished - started:.2f}s "
+          f"({args.updates / (finished - started):.0f} updates/s)")
+    print(f"per-worker total: {stats['processed']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+## logging_setup.py
+
+import atexit
+import itertools
+import logging
+import logging.handlers
+import queue
+from config import LOG_LEVEL, LOG_PAYLOAD_SAMPLE_EVERY, LOG_PAYLOAD_MAX_CHARS
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Exclude logs from httpcore
+class CustomFilter(logging.Filter):
+    def filter(self, record):
+        if record.name.startswith('httpcore'):
+            return False
+        return True
+
+_listener = None
+
+# Send every record through a queue so handlers only enqueue; a listener thread formats and writes
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, handler=None):
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    handler = handler or logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(fmt))
+    handler.addFilter(CustomFilter())
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
+
+    # Set specific log levels for certain modules
+    logging.getLogger('httpcore').setLevel(logging.WARNING)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    logging.getLogger('telegram.ext.ExtBot').setLevel(logging.INFO)
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+_payload_calls = itertools.count()
+
+def log_payload(logger, label, payload):
+    # Only every LOG_PAYLOAD_SAMPLE_EVERY-th payload is rendered, and never unless DEBUG is on for this logger
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if next(_payload_calls) % LOG_PAYLOAD_SAMPLE_EVERY:
+        return
+    text = repr(payload)
+    if len(text) > LOG_PAYLOAD_MAX_CHARS:
+        text = f"{text[:LOG_PAYLOAD_MAX_CHARS]}... ({len(text)} chars)"
+    logger.debug("%s: %s", label, text)
@@ -1,28 +1,66 @@
-import logging
+import argparse
+import asyncio
 from telegram.ext import ApplicationBuilder
-from config import TELEGRAM_API_TOKEN
+from config import TELEGRAM_API_TOKEN, CONCURRENT_UPDATES, TELEGRAM_API_BASE_URL, TELEGRAM_API_BASE_FILE_URL, WEBHOOK_WORKERS, PUBLISH_SLOT_MINUTES, METRICS_PORT
 from handlers import register_handlers
+from github_sync import github_sync
+from utils import cleanup_cache_dir
+from send_queue import rate_limiter
+from publish_queue import run_publish_slots
+from logging_setup import setup_logging
 
-# Set up logging with a custom filter to exclude logs from httpcore and telegram.ext
-class CustomFilter(logging.Filter):
-    def filter(self, record):
-        if record.name.startswith('httpcore'):
-            return False
-        return True
+_background_tasks = set()
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger()
-logger.addFilter(CustomFilter())
+def start_background_tasks(application, metrics_port=METRICS_PORT):
+    cleanup_cache_dir()
+    if metrics_port > 0:
+        from stats import start_metrics_server
+        start_metrics_server(metrics_port)
+    if PUBLISH_SLOT_MINUTES > 0:
+        task = asyncio.create_task(run_publish_slots(application.bot))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
 
-# Set specific log levels for certain modules
-logging.getLogger('httpcore').setLevel(logging.WARNING)
-logging.getLogger('telegram.ext.ExtBot').setLevel(logging.INFO)
-logging.getLogger('httpx').setLevel(logging.WARNING)
+async def post_init(application):
+    start_background_tasks(application)
 
-def main():
-    application = ApplicationBuilder().token(TELEGRAM_API_TOKEN).build()
+async def post_shutdown(application):
+    # Push anything still waiting in the debounce window before exiting
+    await github_sync.flush()
+
+def build_application(updater=True):
+    # Without concurrent updates PTB handles one update at a time, so a slow
+    # forward would still hold back every callback queued behind it.
+    builder = (
+        ApplicationBuilder()
+        .token(TELEGRAM_API_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .rate_limiter(rate_limiter)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(TELEGRAM_API_BASE_URL)
+    if TELEGRAM_API_BASE_FILE_URL:
+        builder = builder.base_file_url(TELEGRAM_API_BASE_FILE_URL)
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
     register_handlers(application)
-    application.run_polling()
+    return application
+
+def main():
+    setup_logging()
+    parser = argparse.ArgumentParser(description='Promotion bot')
+    parser.add_argument('--webhook', action='store_true', help='receive updates through the webhook dispatcher instead of polling')
+    parser.add_argument('--workers', type=int, default=WEBHOOK_WORKERS, help='number of worker processes in webhook mode')
+    args = parser.parse_args()
+
+    if args.webhook:
+        from webhook_dispatcher import run_dispatcher
+        run_dispatcher(args.workers)
+    else:
+        build_application().run_polling()
 
 if __name__ == "__main__":
     main()
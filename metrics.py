@@ -0,0 +1,140 @@
+## metrics.py
+
+import bisect
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from config import METRICS_ENABLED
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Process-wide totals of external API calls, by call name
+api_calls = Counter()
+
+# Other process-wide counters (bytes moved, dedupe hits, ...), by name
+counters = Counter()
+
+# Per-message tally, set for the duration of a handler via track_api_calls()
+_message_api_calls = ContextVar('message_api_calls', default=None)
+
+def count_api_call(name):
+    api_calls[name] += 1
+    message_calls = _message_api_calls.get()
+    if message_calls is not None:
+        message_calls[name] += 1
+
+def increment(name, value=1):
+    counters[name] += value
+
+@contextmanager
+def track_api_calls():
+    message_calls = Counter()
+    token = _message_api_calls.set(message_calls)
+    try:
+        yield message_calls
+    finally:
+        _message_api_calls.reset(token)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One slot per bucket plus a final +Inf slot
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'avg_ms': round(self.sum / self.count * 1000, 1) if self.count else None,
+            'p50_ms': _to_ms(self.quantile(0.5)),
+            'p99_ms': _to_ms(self.quantile(0.99)),
+        }
+
+def _to_ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+# Latency of each hot-path stage (resolve, product_fetch, affiliate_conversion, ...), by stage name
+stage_latency = {}
+_stage_lock = threading.Lock()
+
+def observe(stage, seconds):
+    histogram = stage_latency.get(stage)
+    if histogram is None:
+        with _stage_lock:
+            histogram = stage_latency.setdefault(stage, Histogram())
+    histogram.observe(seconds)
+
+@contextmanager
+def _timer(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+_disabled = nullcontext()
+
+def timed(stage):
+    # With metrics off this hands back one shared no-op context, so instrumented code pays a call and a branch
+    if not METRICS_ENABLED:
+        return _disabled
+    return _timer(stage)
+
+def snapshot():
+    return {
+        'stages': {stage: histogram.snapshot() for stage, histogram in sorted(stage_latency.items())},
+        'api_calls': dict(api_calls),
+        'counters': dict(counters),
+    }
+
+# Prometheus text exposition of stage latencies, API calls, counters and any extra gauges
+def render_prometheus(extra=None):
+    lines = [
+        '# TYPE promo_stage_latency_seconds histogram',
+    ]
+    for stage, histogram in sorted(stage_latency.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+            cumulative += bucket_count
+            lines.append(f'promo_stage_latency_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'promo_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+        lines.append(f'promo_stage_latency_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+        lines.append(f'promo_stage_latency_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+    lines.append('# TYPE promo_api_calls_total counter')
+    for name, value in sorted(api_calls.items()):
+        lines.append(f'promo_api_calls_total{{call="{name}"}} {value}')
+
+    lines.append('# TYPE promo_counter_total counter')
+    for name, value in sorted(counters.items()):
+        lines.append(f'promo_counter_total{{name="{name}"}} {value}')
+
+    if extra:
+        lines.append('# TYPE promo_gauge gauge')
+        for name, value in sorted(extra.items()):
+            lines.append(f'promo_gauge{{name="{name}"}} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,268 @@
+## microbench.py
+#
+# Microbenchmarks for single hot-path modules, kept here so that importing the
+# modules themselves stays cheap, e.g.
+#   python microbench.py links [corpus.txt]
+#   python microbench.py logging
+#   python microbench.py drafts
+#   python microbench.py callbacks
+
+import argparse
+import re
+import timeit
+
+SAMPLE_MESSAGES = [
+    "👌Smartwatch HAYLOU R8 1.43 Tela AMOLED HD\n\n💲 Valor:  R$107,40\n-663 Moedas no APP \n\n"
+    "👀 https://s.click.aliexpress.com/e/_oCnDlWW\n\n✅BOT DE DESCONTOS: @FafaPromobot",
+    "🔥 Fone Bluetooth TWS\n💲 R$39,90\n👉 https://a.aliexpress.com/_opN11Ia\n👉 https://pt.aliexpress.com/item/1005006099512491.html?spm=a2g0o",
+    "TOP 5 OFERTAS\n1) https://www.aliexpress.com/item/1005004521234567.html\n2) https://a.aliexpress.com/_mKq1xYz\n"
+    "3) https://amzn.to/3xYzAbC\n4) https://pt.aliexpress.com/item/1005005123456789.html?gatewayAdapt=glo2bra\n"
+    "5) https://shopee.com.br/product/12345/67890 (frete grátis)",
+]
+
+def _legacy_parse(text, tracking_id='tracking'):
+    # The URL work a forwarded message used to cost before link_parser: the
+    # handler's search, three convert_affiliate_links passes and get_product_id
+    url = re.compile(r'https?://[^\s]+').search(text).group(0)
+    for _ in range(3):
+        for candidate in re.compile(r'https?://[^\s]+').findall(text):
+            if "aliexpress.com" in candidate:
+                any(part in candidate for part in [tracking_id, 's.click.aliexpress.com'])
+    match = re.search(r'/item/(\d+).html', url)
+    if not match:
+        match = re.search(r'/(\d+)\.html', url)
+    return url, match.group(1) if match else None
+
+def bench_links(args):
+    from link_parser import parse_links
+
+    messages = SAMPLE_MESSAGES
+    if args.corpus:
+        # Messages separated by two blank lines
+        with open(args.corpus, encoding='utf-8') as file:
+            messages = [message for message in file.read().split('\n\n\n') if message.strip()]
+
+    number = 20000
+    legacy = timeit.timeit(lambda: [_legacy_parse(message) for message in messages], number=number)
+    current = timeit.timeit(lambda: [parse_links(message) for message in messages], number=number)
+    per_message = 1e6 / (number * len(messages))
+    print(f"{len(messages)} messages x {number} runs")
+    print(f"legacy per-message URL handling: {legacy * per_message:.2f} us/message")
+    print(f"single parse_links pass:         {current * per_message:.2f} us/message")
+
+def bench_logging(args):
+    # Per-message logging cost: the old setup (root at DEBUG, f-strings, payloads and
+    # image lists written synchronously) against logging_setup (INFO, lazy args, queue)
+    import io
+    import logging
+    import time
+    from logging_setup import LOG_FORMAT, setup_logging, stop_logging, log_payload
+
+    class ProductInfo:
+        def __init__(self, index):
+            self.product_id = 1005006000000000 + index
+            self.product_title = 'Wireless earbuds with charging case ' * 3
+            self.product_small_image_urls = [f'https://ae01.alicdn.com/kf/S{index}{n}.jpg' for n in range(6)]
+            self.promotion_link = f'https://s.click.aliexpress.com/e/_{index}'
+
+        def __repr__(self):
+            return f"ProductInfo({self.__dict__!r})"
+
+    response = [ProductInfo(index) for index in range(3)]
+    images = response[0].product_small_image_urls
+    messages = 5000
+
+    def old_style_message(log):
+        logging.debug(f"Fetching details for Product ID: {response[0].product_id}")
+        logging.debug(f"API Response: {response}")
+        logging.debug(f"Generating affiliate link for URL: {response[0].promotion_link}")
+        logging.debug(f"API Response: {response}")
+        log.info(f"Received forwarded message: {response[0].product_title}")
+        log.info(f"Product ID: {response[0].product_id}")
+        log.info(f"Product Title: {response[0].product_title}")
+        log.info(f"Product Small Images: {images}")
+        log.info(f"Affiliate Link: {response[0].promotion_link}")
+
+    def new_style_message(log):
+        log.debug("Fetching details for Product ID: %s", response[0].product_id)
+        log_payload(log, "API Response", response)
+        log.debug("Generating affiliate link for URL: %s", response[0].promotion_link)
+        log_payload(log, "API Response", response)
+        log.info("Processed product %s (%s images, API calls: %s)", response[0].product_id, len(images), {'get_products_details': 1})
+        log.debug("Product Small Images: %s", images)
+
+    def measure(message, log):
+        started = time.perf_counter()
+        for _ in range(messages):
+            message(log)
+        return (time.perf_counter() - started) / messages * 1e6
+
+    sink = io.StringIO()
+    logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT, stream=sink)
+    old_us = measure(old_style_message, logging.getLogger('handlers'))
+    old_bytes = sink.tell()
+
+    sink = io.StringIO()
+    setup_logging(level='INFO', handler=logging.StreamHandler(sink))
+    new_us = measure(new_style_message, logging.getLogger('handlers'))
+    stop_logging()
+
+    print(f"old: {old_us:.1f} us/message on the calling thread, {old_bytes // messages} bytes/message")
+    print(f"new: {new_us:.1f} us/message on the calling thread, {sink.tell() // messages} bytes/message")
+
+def bench_drafts(args):
+    # Memory held by 10k open drafts over 500 products, each draft built from its
+    # own copy of the product details (as decoded from an API response or cache row)
+    import json
+    import tracemalloc
+    from draft_store import Draft, intern_product
+
+    def product_details(product_number):
+        return json.loads(json.dumps({
+            'product_id': str(1005006000000000 + product_number),
+            'product_title': f"Wireless Bluetooth 5.3 earbuds with charging case, model {product_number}",
+            'small_image_urls': [f"https://ae01.alicdn.com/kf/S{product_number:08d}{n}a7c3e1f0b9d24c5e8f6a.jpg" for n in range(6)],
+        }))
+
+    def legacy_draft(number, details):
+        small_images = list(details['small_image_urls'])
+        small_images.append(f"AgACAgQAAxkBAAI{number:012d}")
+        return {
+            'original': f"Deal {number}: earbuds for $9.99 https://www.aliexpress.com/item/{details['product_id']}.html",
+            'converted': f"Deal {number}: earbuds for $9.99 https://s.click.aliexpress.com/e/_{number:08d}",
+            'photo': small_images[-1],
+            'chat_id': 1000 + number % 20,
+            'message_ids': [number * 2, number * 2 + 1],
+            'product_id': details['product_id'],
+            'product_title': details['product_title'],
+            'small_images': small_images,
+            'affiliate_link': f"https://s.click.aliexpress.com/e/_{number:08d}",
+        }
+
+    def slotted_draft(number, details):
+        photo = f"AgACAgQAAxkBAAI{number:012d}"
+        return Draft(
+            original=f"Deal {number}: earbuds for $9.99 https://www.aliexpress.com/item/{details['product_id']}.html",
+            converted=f"Deal {number}: earbuds for $9.99 https://s.click.aliexpress.com/e/_{number:08d}",
+            chat_id=1000 + number % 20,
+            product=intern_product(details['product_id'], details['product_title'], details['small_image_urls']),
+            affiliate_link=f"https://s.click.aliexpress.com/e/_{number:08d}",
+            photo=photo,
+            forwarded_photo=photo,
+            message_ids=[number * 2, number * 2 + 1],
+        )
+
+    def measure(build):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        store = build()
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        return used, store
+
+    count, products = 10_000, 500
+    stores = {
+        'dicts': lambda: {(1000 + n % 20, n): legacy_draft(n, product_details(n % products)) for n in range(count)},
+        'dicts as JSON': lambda: {(1000 + n % 20, n): json.dumps(legacy_draft(n, product_details(n % products))) for n in range(count)},
+        'slotted + interned': lambda: {(1000 + n % 20, n): slotted_draft(n, product_details(n % products)) for n in range(count)},
+    }
+    for name, build in stores.items():
+        used, _ = measure(build)
+        print(f"{name:<20} {used / 2**20:6.1f} MiB  {used / count:6.0f} bytes/draft")
+
+def bench_callbacks(args):
+    # Callback handling cost per button press: the old split + if/elif chain and
+    # fresh keyboards against the router's dispatch table and cached markups
+    import logging
+    from types import SimpleNamespace
+    from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+    from callbacks import CallbackRouter, encode, draft_keyboard
+
+    logger = logging.getLogger('handlers')
+    router = CallbackRouter()
+
+    chat_id, message_id = -1001987654321, 48213
+    legacy_commands = ['replace_image', 'edit_text', 'publish', 'cancel', 'confirm_publish', 'deny_publish', 'confirm_cancel', 'deny_cancel']
+
+    async def noop(*args):
+        pass
+
+    async def on_button(update, context, chat_id, message_id):
+        pass
+
+    for command in legacy_commands:
+        router.route(command)(on_button)
+
+    async def legacy_dispatch(update):
+        query = update.callback_query
+        await query.answer()
+        parts = query.data.split(":")
+        command, message_id = parts[0], int(parts[1])
+        chat_id = query.message.chat_id
+        logger.info(f"Button click received: {command}, chat_id: {chat_id}, message_id: {message_id}")
+        for candidate in legacy_commands:
+            if command == candidate:
+                await noop(command, message_id)
+                break
+
+    def legacy_keyboard(message_id):
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("Replace Image", callback_data=f"replace_image:{message_id}")],
+            [InlineKeyboardButton("Edit Text", callback_data=f"edit_text:{message_id}")],
+            [InlineKeyboardButton("Publish", callback_data=f"publish:{message_id}")],
+            [InlineKeyboardButton("Cancel", callback_data=f"cancel:{message_id}")]
+        ])
+
+    async def answer():
+        pass
+
+    def update_for(data):
+        query = SimpleNamespace(data=data, answer=answer, message=SimpleNamespace(chat_id=chat_id))
+        return SimpleNamespace(callback_query=query)
+
+    legacy_update = update_for(f"deny_cancel:{message_id}")
+    compact_update = update_for(encode('deny_cancel', chat_id, message_id))
+    number = 10000
+
+    def run(coroutine):
+        # Nothing here really suspends, so one send() runs it to completion without an event loop
+        try:
+            coroutine.send(None)
+        except StopIteration:
+            pass
+
+    def per_call(*statements):
+        # Rounds alternate between the statements so a slow patch on the machine
+        # hits all of them; each keeps its best round
+        best = [float('inf')] * len(statements)
+        for _ in range(25):
+            for i, statement in enumerate(statements):
+                best[i] = min(best[i], timeit.timeit(statement, number=number))
+        return [seconds / number * 1e6 for seconds in best]
+
+    print(f"callback_data: {len(legacy_update.callback_query.data)} bytes without the chat id, "
+          f"{len(compact_update.callback_query.data)} bytes with it")
+    legacy, compact, old_button = per_call(lambda: run(legacy_dispatch(legacy_update)),
+                                           lambda: run(router.dispatch(compact_update, None)),
+                                           lambda: run(router.dispatch(legacy_update, None)))
+    print(f"dispatch, split + if/elif:    {legacy:.2f} us")
+    print(f"dispatch, router table:       {compact:.2f} us")
+    print(f"dispatch, router, old button: {old_button:.2f} us")
+    built, cached = per_call(lambda: legacy_keyboard(message_id), lambda: draft_keyboard(chat_id, message_id))
+    print(f"keyboard, built every time:   {built:.2f} us")
+    print(f"keyboard, cached markup:      {cached:.2f} us")
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks for hot-path modules')
+    benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+    links = benchmarks.add_parser('links', help='parse_links against the old per-message URL handling')
+    links.add_argument('corpus', nargs='?', help='promo messages separated by two blank lines (default: built-in samples)')
+    links.set_defaults(run=bench_links)
+    benchmarks.add_parser('callbacks', help='button press dispatch and keyboard building').set_defaults(run=bench_callbacks)
+    benchmarks.add_parser('drafts', help='memory per open draft: dicts against slotted drafts').set_defaults(run=bench_drafts)
+    benchmarks.add_parser('logging', help='per-message logging cost, old setup against logging_setup').set_defaults(run=bench_logging)
+    args = parser.parse_args()
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+## product_batcher.py
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Collects product IDs requested within a short window and resolves them with a
+# single batched lookup. fetch_batch is a coroutine taking a list of product IDs
+# and returning a {product_id: details} dict.
+class ProductBatcher:
+    def __init__(self, fetch_batch, window_ms=50, max_batch=20):
+        self.fetch_batch = fetch_batch
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.batches_sent = 0
+        self.ids_requested = 0
+        self._pending = {}
+        self._timer = None
+        self._tasks = set()
+
+    async def get(self, product_id):
+        product_id = str(product_id)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(product_id, []).append(future)
+        self.ids_requested += 1
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._dispatch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch):
+        self.batches_sent += 1
+        logger.debug("Dispatching product batch of %s IDs", len(batch))
+        try:
+            results = await self.fetch_batch(list(batch)) or {}
+        except Exception as e:
+            logger.error("Product batch lookup failed: %s", e)
+            results = {}
+        for product_id, futures in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(results.get(product_id))
+
+    def stats(self):
+        return {
+            'batches_sent': self.batches_sent,
+            'ids_requested': self.ids_requested,
+            'pending': len(self._pending),
+        }
@@ -0,0 +1,226 @@
+## publish_queue.py
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from itertools import count
+from telegram.error import BadRequest
+from config import ensure_parent_dir, PUBLISH_SLOT_MINUTES, PUBLISH_SLOT_SIZE, PUBLISH_QUEUE_DB_PATH, PUBLISH_MAX_ATTEMPTS
+from draft_store import Draft
+from github_sync import github_sync
+from send_queue import PRIORITY_PUBLISH
+from services import upload_image_async, feed_entry, publish_feed_entries_async
+
+logger = logging.getLogger(__name__)
+
+async def add_to_feed(bot, drafts_to_publish, push=False):
+    entries = []
+    for draft in drafts_to_publish:
+        image = None
+        if draft.photo:
+            image = await upload_image_async(bot, draft.photo)
+        original_content = draft.original
+        entries.append(feed_entry(
+            content=draft.converted,
+            title=original_content[:30] if len(original_content) > 30 else None,
+            description=draft.converted,
+            image=image
+        ))
+    await publish_feed_entries_async(entries)
+    if push:
+        await github_sync.flush()
+
+async def send_post(bot, draft):
+    if draft.photo:
+        await bot.send_photo(chat_id=draft.chat_id, photo=draft.photo, caption=draft.converted, rate_limit_args=PRIORITY_PUBLISH)
+    else:
+        await bot.send_message(chat_id=draft.chat_id, text=draft.converted, rate_limit_args=PRIORITY_PUBLISH)
+
+# Approved drafts waiting for their slot. Rows are claimed before publishing so
+# that several worker processes sharing the file never post the same draft twice.
+# posted and in_feed record how far a row got, so a retried row only redoes the
+# rest; a row that keeps failing gets failed_at and is no longer claimed.
+class PublishQueue:
+    def __init__(self, path=PUBLISH_QUEUE_DB_PATH):
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._claims = count()
+        self._lock = threading.Lock()
+        ensure_parent_dir(path)
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS scheduled_posts (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "draft TEXT NOT NULL, created_at REAL NOT NULL, claimed_by TEXT, claimed_at REAL, in_feed INTEGER NOT NULL DEFAULT 0, "
+            "posted INTEGER NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0, failed_at REAL, last_error TEXT)"
+        )
+        # One row per slot, taken by the first worker to wake for it
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS publish_slots (slot INTEGER PRIMARY KEY, claimed_by TEXT NOT NULL, claimed_at REAL NOT NULL)"
+        )
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(scheduled_posts)")}
+        for column, definition in (('in_feed', 'INTEGER NOT NULL DEFAULT 0'), ('posted', 'INTEGER NOT NULL DEFAULT 0'),
+                                   ('attempts', 'INTEGER NOT NULL DEFAULT 0'), ('failed_at', 'REAL'), ('last_error', 'TEXT')):
+            if column not in columns:
+                self._connection.execute(f"ALTER TABLE scheduled_posts ADD COLUMN {column} {definition}")
+        self._connection.commit()
+
+    def enqueue(self, draft):
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO scheduled_posts (draft, created_at) VALUES (?, ?)", (json.dumps(draft.to_dict()), time.time())
+            )
+            self._connection.commit()
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM scheduled_posts WHERE id <= ?", (cursor.lastrowid,)
+            ).fetchone()[0]
+
+    def claim_slot(self, slot):
+        # True for exactly one worker per slot, so a slot posts slot_size drafts however many workers share the queue
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO publish_slots (slot, claimed_by, claimed_at) VALUES (?, ?, ?)",
+                (slot, self.owner, time.time())
+            )
+            self._connection.execute("DELETE FROM publish_slots WHERE slot < ?", (slot - 100,))
+            self._connection.commit()
+            return cursor.rowcount == 1
+
+    def claim(self, limit, claim_timeout):
+        # Returns (id, draft, posted, in_feed) rows. Every claim has its own token,
+        # so rows this worker still holds from an earlier claim aren't returned again
+        now = time.time()
+        token = f"{self.owner}-{next(self._claims)}"
+        with self._lock:
+            self._connection.execute(
+                "UPDATE scheduled_posts SET claimed_by = ?, claimed_at = ? WHERE id IN "
+                "(SELECT id FROM scheduled_posts WHERE failed_at IS NULL AND (claimed_by IS NULL OR claimed_at < ?) ORDER BY id LIMIT ?)",
+                (token, now, now - claim_timeout, limit)
+            )
+            self._connection.commit()
+            rows = self._connection.execute(
+                "SELECT id, draft, posted, in_feed FROM scheduled_posts WHERE claimed_by = ? ORDER BY id", (token,)
+            ).fetchall()
+        return [(row[0], Draft.from_dict(json.loads(row[1])), bool(row[2]), bool(row[3])) for row in rows]
+
+    def mark_posted(self, post_ids):
+        self._execute_many("UPDATE scheduled_posts SET posted = 1 WHERE id = ?", post_ids)
+
+    def fail(self, post_id, error, permanent=False, max_attempts=PUBLISH_MAX_ATTEMPTS):
+        # Counts a failed send and returns how many there have been. The row stays
+        # claimed until the slot releases it; from max_attempts on, or straight away
+        # for an error retrying can't fix, it is set aside with failed_at
+        with self._lock:
+            self._connection.execute(
+                "UPDATE scheduled_posts SET attempts = attempts + 1, last_error = ? WHERE id = ?", (str(error)[:500], post_id)
+            )
+            attempts = self._connection.execute("SELECT attempts FROM scheduled_posts WHERE id = ?", (post_id,)).fetchone()[0]
+            if permanent or attempts >= max_attempts:
+                self._connection.execute("UPDATE scheduled_posts SET failed_at = ? WHERE id = ?", (time.time(), post_id))
+            self._connection.commit()
+        return attempts
+
+    def mark_in_feed(self, post_ids):
+        self._execute_many("UPDATE scheduled_posts SET in_feed = 1 WHERE id = ?", post_ids)
+
+    def complete(self, post_ids):
+        self._execute_many("DELETE FROM scheduled_posts WHERE id = ?", post_ids)
+
+    def release(self, post_ids):
+        self._execute_many("UPDATE scheduled_posts SET claimed_by = NULL, claimed_at = NULL WHERE id = ?", post_ids)
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM scheduled_posts WHERE failed_at IS NULL").fetchone()[0]
+
+    def failed_count(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM scheduled_posts WHERE failed_at IS NOT NULL").fetchone()[0]
+
+    def _execute_many(self, statement, post_ids):
+        with self._lock:
+            self._connection.executemany(statement, [(post_id,) for post_id in post_ids])
+            self._connection.commit()
+
+publish_queue = PublishQueue() if PUBLISH_SLOT_MINUTES > 0 else None
+
+async def publish_slot(bot, slot_size=PUBLISH_SLOT_SIZE, claim_timeout=None):
+    claim_timeout = claim_timeout or PUBLISH_SLOT_MINUTES * 60
+    held, posted, failed = [], [], []
+    retry_later = False
+    try:
+        # A post Telegram rejects is set aside and the next one is claimed in its
+        # place, so it never holds back the posts queued after it. Any other error
+        # most likely hits every post, so the rest of the slot waits for the next one
+        while len(posted) < slot_size and not retry_later:
+            claimed = publish_queue.claim(slot_size - len(posted), claim_timeout)
+            if not claimed:
+                break
+            held.extend(post_id for post_id, _, _, _ in claimed)
+            for post_id, draft, already_posted, in_feed in claimed:
+                if not already_posted:
+                    try:
+                        await send_post(bot, draft)
+                    except Exception as e:
+                        failed.append(post_id)
+                        await _report_failed_post(bot, post_id, draft, e)
+                        retry_later = not isinstance(e, BadRequest)
+                        if retry_later:
+                            break
+                        continue
+                    publish_queue.mark_posted([post_id])
+                posted.append((post_id, draft, in_feed))
+
+        # Posts go out before their feed entries, so a send that fails never
+        # leaves an item in the feed; the render and push happen once per slot
+        not_in_feed = [(post_id, draft) for post_id, draft, in_feed in posted if not in_feed]
+        if not_in_feed:
+            await add_to_feed(bot, [draft for _, draft in not_in_feed], push=True)
+            publish_queue.mark_in_feed([post_id for post_id, _ in not_in_feed])
+        publish_queue.complete([post_id for post_id, _, _ in posted])
+    finally:
+        # Completed rows are gone, so this hands back the failed rows and, after an
+        # error, the ones still to do; posted rows only get their feed entry next time
+        publish_queue.release(held)
+    if not posted and not failed:
+        return 0
+    logger.info("Published %s scheduled posts, %s failed, %s still queued", len(posted), len(failed), len(publish_queue))
+    return len(posted)
+
+async def _report_failed_post(bot, post_id, draft, error):
+    # Telegram rejects a BadRequest the same way every time, so those rows aren't retried
+    permanent = isinstance(error, BadRequest)
+    attempts = publish_queue.fail(post_id, error, permanent)
+    if attempts < PUBLISH_MAX_ATTEMPTS and not permanent:
+        logger.warning("Scheduled post %s failed (attempt %s of %s): %s", post_id, attempts, PUBLISH_MAX_ATTEMPTS, error)
+        return
+    logger.error("Scheduled post %s failed after %s attempts and was taken off the queue: %s", post_id, attempts, error)
+    try:
+        # The draft is gone by now, so the admin who approved it is the only one who can redo it
+        await bot.send_message(draft.chat_id, text=f"A scheduled post could not be published and was taken off the queue: "
+                                                   f"{error}\n\n{draft.converted[:500]}")
+    except Exception as e:
+        logger.error("Failed to report scheduled post %s to chat %s: %s", post_id, draft.chat_id, e)
+
+async def run_publish_slots(bot):
+    interval = PUBLISH_SLOT_MINUTES * 60
+    while True:
+        # Slots line up with the wall clock so every worker wakes for the same slot,
+        # and whichever claims it first publishes it
+        delay = interval - time.time() % interval
+        slot = round((time.time() + delay) / interval)
+        await asyncio.sleep(delay)
+        try:
+            if not publish_queue.claim_slot(slot):
+                continue
+            await publish_slot(bot)
+        except Exception as e:
+            logger.error("Scheduled publishing failed: %s", e)
+
+def next_slot_time():
+    interval = PUBLISH_SLOT_MINUTES * 60
+    return time.time() + interval - time.time() % interval
@@ -1,38 +1,200 @@
-from feedgen.feed import FeedGenerator
 from xml.etree import ElementTree as ET
+from collections import deque
+from datetime import datetime, timezone
+import json
+import logging
 import os
+import threading
+from contextlib import contextmanager
+from config import RSS_FEED_PATH, RSS_STORE_PATH, RSS_MAX_ITEMS
+from metrics import timed
 
-RSS_FEED_PATH = 'rss-feed_promo.xml'  # Place the file at the root level
+try:
+    import fcntl
+except ImportError:
+    # Windows: no cross-process lock, which is fine for the single polling process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FEED_TITLE = 'Promotion Feed'
+FEED_LINK = 'http://example.com'
+FEED_DESCRIPTION = 'Latest promotions and deals'
+
+_lock = threading.RLock()
+_lock_depth = 0
+_items = None
+_rendered = None
+# Size of the store after our last read or write; a mismatch means another
+# worker process appended items, so the window is reloaded from disk
+_store_size = 0
+
+@contextmanager
+def _store_lock():
+    # The process lock plus, where there is fcntl, an flock shared with the other
+    # workers, so appending and read-render-replace never interleave between
+    # processes. Reentrant: flock on a second descriptor would block on our own lock
+    global _lock_depth
+    with _lock:
+        lock_file = None
+        if _lock_depth == 0 and fcntl is not None:
+            lock_file = open(f"{RSS_STORE_PATH}.lock", 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        _lock_depth += 1
+        try:
+            yield
+        finally:
+            _lock_depth -= 1
+            if lock_file is not None:
+                lock_file.close()
 
 def create_feed():
+    # feedgen (and its lxml dependency) is only needed once a feed is rendered
+    from feedgen.feed import FeedGenerator
+
     fg = FeedGenerator()
-    fg.title('Promotion Feed')
-    fg.link(href='http://example.com', rel='alternate')
-    fg.description('Latest promotions and deals')
+    fg.title(FEED_TITLE)
+    fg.link(href=FEED_LINK, rel='alternate')
+    fg.description(FEED_DESCRIPTION)
     fg.language('en')
     return fg
 
-def add_to_rss_feed(content, title=None, description=None, image_url=None):
-    if os.path.exists(RSS_FEED_PATH):
-        tree = ET.parse(RSS_FEED_PATH)
-        root = tree.getroot()
-        
-        # Create a new feed generator and load the existing feed
-        fg = FeedGenerator()
-        fg.title(root.find('channel/title').text)
-        fg.link(href=root.find('channel/link').text, rel='alternate')
-        fg.description(root.find('channel/description').text)
-        fg.language('en')
-        fg.rss_str(ET.tostring(root, encoding='utf-8', method='xml'))
-    else:
-        fg = create_feed()
-
-    fe = fg.add_entry()
-    fe.title(title if title else content[:30])  # Use provided title or first 30 characters of the content
-    fe.link(href='http://example.com')  # Replace with the actual link
-    fe.description(description if description else content)
-    
-    if image_url:
-        fe.enclosure(image_url, 0, 'image/jpeg')  # Add image URL
-
-    fg.rss_file(RSS_FEED_PATH)
+def _read_tail(path, count, block_size=64 * 1024):
+    # Read only the last `count` lines so startup cost doesn't grow with the store
+    with open(path, 'rb') as file:
+        file.seek(0, os.SEEK_END)
+        position = file.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= count:
+            read_size = min(block_size, position)
+            position -= read_size
+            file.seek(position)
+            data = file.read(read_size) + data
+    lines = [line for line in data.splitlines() if line.strip()]
+    return lines[-count:] if count else []
+
+def _truncate_partial_line(path, block_size=64 * 1024):
+    # A crash in the middle of an append leaves a last line without its newline;
+    # it's cut off so the next append doesn't run on from it
+    with open(path, 'rb+') as file:
+        size = file.seek(0, os.SEEK_END)
+        if not size:
+            return
+        file.seek(size - 1)
+        if file.read(1) == b'\n':
+            return
+        position = size
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            file.seek(position)
+            newline = file.read(read_size).rfind(b'\n')
+            if newline != -1:
+                position += newline + 1
+                break
+        file.truncate(position)
+    logger.warning("Dropped a partial line of %s bytes at the end of %s", size - position, path)
+
+def _import_existing_feed():
+    # One-off migration of items already published in the XML feed
+    if not os.path.exists(RSS_FEED_PATH):
+        return
+    root = ET.parse(RSS_FEED_PATH).getroot()
+    items = []
+    for element in root.findall('channel/item'):
+        enclosure = element.find('enclosure')
+        items.append({
+            'title': element.findtext('title'),
+            'link': element.findtext('link') or FEED_LINK,
+            'description': element.findtext('description'),
+            'image_url': enclosure.get('url') if enclosure is not None else None,
+            'image_length': int(enclosure.get('length') or 0) if enclosure is not None else 0,
+            'image_type': enclosure.get('type') if enclosure is not None else None,
+            'published': None,
+        })
+    # feedgen writes the newest item first
+    items.reverse()
+    with open(RSS_STORE_PATH, 'a', encoding='utf-8') as store:
+        for item in items:
+            store.write(json.dumps(item, ensure_ascii=False) + '\n')
+    logger.info("Imported %s existing feed items into %s", len(items), RSS_STORE_PATH)
+
+def _store_changed():
+    return os.path.exists(RSS_STORE_PATH) and os.path.getsize(RSS_STORE_PATH) != _store_size
+
+def _load_items():
+    global _items, _rendered, _store_size
+    if _items is None or _store_changed():
+        if not os.path.exists(RSS_STORE_PATH):
+            _import_existing_feed()
+        _items = deque(maxlen=RSS_MAX_ITEMS)
+        _rendered = None
+        if os.path.exists(RSS_STORE_PATH):
+            _truncate_partial_line(RSS_STORE_PATH)
+            _store_size = os.path.getsize(RSS_STORE_PATH)
+            for line in _read_tail(RSS_STORE_PATH, RSS_MAX_ITEMS):
+                try:
+                    _items.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping undecodable line in %s: %.80r", RSS_STORE_PATH, line)
+    return _items
+
+def render_items(items):
+    fg = create_feed()
+    for item in items:
+        fe = fg.add_entry()
+        fe.title(item['title'])
+        fe.link(href=item['link'])
+        fe.description(item['description'])
+        if item.get('published'):
+            fe.pubDate(datetime.fromisoformat(item['published']))
+        if item.get('image_url'):
+            fe.enclosure(item['image_url'], str(item.get('image_length') or 0), item.get('image_type') or 'image/jpeg')
+    return fg.rss_str(pretty=False)
+
+def render_feed():
+    global _rendered
+    with _store_lock():
+        items = _load_items()
+        if _rendered is None:
+            with timed('feed_render'):
+                _rendered = render_items(items)
+        return _rendered
+
+def _make_item(content, title=None, description=None, image_url=None, image_length=0, image_type=None, published=None):
+    return {
+        'title': title if title else content[:30],  # Use provided title or first 30 characters of the content
+        'link': FEED_LINK,  # Replace with the actual link
+        'description': description if description else content,
+        'image_url': image_url,
+        'image_length': image_length,
+        'image_type': image_type,
+        # Backfilled items keep their original (timezone-aware) date
+        'published': (published or datetime.now(timezone.utc)).isoformat(),
+    }
+
+def write_feed():
+    # Renders the newest items in the shared store, picking up what other workers
+    # appended, and replaces the local XML; returns the rendered bytes
+    with _store_lock():
+        rss_feed_content = render_feed()
+        temp_path = f"{RSS_FEED_PATH}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(rss_feed_content)
+        os.replace(temp_path, RSS_FEED_PATH)
+    return rss_feed_content
+
+def add_entries_to_rss_feed(entries):
+    # entries are services.feed_entry dicts; the feed is rendered once for all of them
+    global _rendered, _store_size
+    new_items = [_make_item(**entry) for entry in entries]
+    with _store_lock():
+        items = _load_items()
+        data = ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in new_items).encode('utf-8')
+        # A single O_APPEND write keeps lines whole when several workers append
+        with open(RSS_STORE_PATH, 'ab') as store:
+            store.write(data)
+        items.extend(new_items)
+        _store_size += len(data)
+        _rendered = None
+        return write_feed()
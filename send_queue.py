@@ -0,0 +1,205 @@
+## send_queue.py
+
+import asyncio
+import itertools
+import logging
+from datetime import timedelta
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_MAX_RETRIES
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Lower value is sent first
+PRIORITY_REPLY = 0
+PRIORITY_PUBLISH = 1
+PRIORITY_CLEANUP = 2
+
+ENDPOINT_PRIORITIES = {
+    'deleteMessage': PRIORITY_CLEANUP,
+    'deleteMessages': PRIORITY_CLEANUP,
+}
+
+# Calls that don't send anything to a chat skip the queue
+UNLIMITED_ENDPOINTS = {'answerCallbackQuery', 'getFile', 'getMe', 'getUpdates', 'setWebhook', 'deleteWebhook'}
+
+# Idle per-chat buckets are dropped once there are more than this many
+MAX_CHAT_BUCKETS = 1000
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+
+    def _refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+def _retry_after_seconds(error):
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+# Plugged into ApplicationBuilder().rate_limiter(), so every context.bot call
+# goes through one priority queue: user-facing replies first, then channel
+# posts, then cleanup deletes, each within the global and per-chat rates.
+class PriorityRateLimiter(BaseRateLimiter):
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE,
+                 chat_burst=SEND_CHAT_BURST, max_retries=SEND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.sent = 0
+        self.retried = 0
+        self.flood_waits = 0
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._jobs = []
+        self._sequence = itertools.count()
+        self._paused_until = 0
+        self._wakeup = None
+        self._worker = None
+        self._tasks = set()
+
+    async def initialize(self):
+        self._ensure_worker()
+
+    async def shutdown(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        for job in self._jobs:
+            if not job[6].done():
+                job[6].cancel()
+        self._jobs.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        # Measured from the caller's side, so time spent waiting for a token counts too
+        with timed('telegram_send'):
+            if endpoint in UNLIMITED_ENDPOINTS:
+                return await callback(*args, **kwargs)
+            priority = rate_limit_args if isinstance(rate_limit_args, int) else ENDPOINT_PRIORITIES.get(endpoint, PRIORITY_REPLY)
+            future = asyncio.get_running_loop().create_future()
+            self._push(priority, data.get('chat_id'), callback, args, kwargs, future, 0)
+            return await future
+
+    def stats(self):
+        by_priority = {}
+        for job in self._jobs:
+            by_priority[job[0]] = by_priority.get(job[0], 0) + 1
+        return {
+            'queue_depth': len(self._jobs),
+            'queue_depth_by_priority': by_priority,
+            'sent': self.sent,
+            'retried': self.retried,
+            'flood_waits': self.flood_waits,
+        }
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    def _push(self, priority, chat_id, callback, args, kwargs, future, attempts):
+        self._ensure_worker()
+        self._jobs.append((priority, next(self._sequence), chat_id, callback, args, kwargs, future, attempts))
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _next_ready(self, now):
+        # Highest-priority job whose chat still has budget, so one throttled chat doesn't block the rest
+        best, wait = None, None
+        for index, job in enumerate(self._jobs):
+            delay = self._chat_bucket(job[2]).delay(now) if job[2] is not None else 0
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+            elif best is None or job[:2] < self._jobs[best][:2]:
+                best = index
+        return best, wait
+
+    def _prune_buckets(self, now):
+        if len(self._chat_buckets) > MAX_CHAT_BUCKETS:
+            waiting = {job[2] for job in self._jobs}
+            for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items()
+                            if chat_id not in waiting and bucket.is_full(now)]:
+                del self._chat_buckets[chat_id]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._jobs:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = loop.time()
+            wait = max(self._paused_until - now, self._global.delay(now))
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            index, wait = self._next_ready(now)
+            if index is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job = self._jobs.pop(index)
+            self._global.consume(now)
+            if job[2] is not None:
+                self._chat_bucket(job[2]).consume(now)
+            self._prune_buckets(now)
+            task = asyncio.create_task(self._execute(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, job):
+        priority, _, chat_id, callback, args, kwargs, future, attempts = job
+        if future.done():
+            return
+        try:
+            result = await callback(*args, **kwargs)
+        except RetryAfter as e:
+            delay = _retry_after_seconds(e)
+            self.flood_waits += 1
+            self._paused_until = max(self._paused_until, asyncio.get_running_loop().time() + delay)
+            logger.warning("Flood control hit for chat %s, pausing sends for %ss", chat_id, delay)
+            if attempts < self.max_retries and not future.done():
+                self.retried += 1
+                self._push(priority, chat_id, callback, args, kwargs, future, attempts + 1)
+            elif not future.done():
+                future.set_exception(e)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            self.sent += 1
+            if not future.done():
+                future.set_result(result)
+
+rate_limiter = PriorityRateLimiter()
@@ -0,0 +1,117 @@
+## services.py
+
+import asyncio
+import contextvars
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from config import SERVICE_MAX_WORKERS, SERVICE_TIMEOUT, PRODUCT_BATCH_WINDOW_MS, PRODUCT_BATCH_MAX, RSS_FEED_PATH
+from affiliate_converter import convert_affiliate_links_with_map, generate_affiliate_link, generate_affiliate_links
+from aliexpress_scraper import resolve_product_id, get_products_details_batch
+from cache import product_cache, uploaded_images
+from metrics import increment, timed
+from utils import download_to_memory, download_url
+from image_processing import process_image_async
+from product_batcher import ProductBatcher
+from rss_feed_generator import add_entries_to_rss_feed, write_feed
+from github_sync import github_sync
+
+logger = logging.getLogger(__name__)
+
+# Every blocking call made from a handler goes through this pool so the
+# polling loop keeps answering other admins while one promo is processed.
+_executor = ThreadPoolExecutor(max_workers=SERVICE_MAX_WORKERS, thread_name_prefix='promo-io')
+
+async def run_blocking(func, *args, timeout=SERVICE_TIMEOUT, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Copy the context so per-message instrumentation follows the call into the pool
+    context = contextvars.copy_context()
+    future = loop.run_in_executor(_executor, partial(context.run, func, *args, **kwargs))
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        logger.error("%s timed out after %ss", getattr(func, '__name__', func), timeout)
+        return None
+
+async def generate_affiliate_link_async(source_url):
+    return await run_blocking(generate_affiliate_link, source_url)
+
+async def generate_affiliate_links_async(source_urls):
+    return await run_blocking(generate_affiliate_links, source_urls) or {}
+
+async def convert_affiliate_links_async(content, links=None):
+    with timed('affiliate_conversion'):
+        result = await run_blocking(convert_affiliate_links_with_map, content, links)
+    return result if result is not None else (content, {})
+
+async def _fetch_products_batch(product_ids):
+    return await run_blocking(get_products_details_batch, product_ids)
+
+product_batcher = ProductBatcher(_fetch_products_batch, PRODUCT_BATCH_WINDOW_MS, PRODUCT_BATCH_MAX)
+
+async def fetch_product_details_async(url):
+    with timed('product_fetch'):
+        product_id = await run_blocking(resolve_product_id, url)
+        if not product_id:
+            return None
+        cached = product_cache.get(product_id)
+        if cached:
+            return cached
+        return await product_batcher.get(product_id)
+
+async def _load_image(bot, photo):
+    if photo.startswith(('http://', 'https://')):
+        return await run_blocking(download_url, photo)
+    return await download_to_memory(bot, photo)
+
+def image_path(content_hash, extension):
+    # Named by content, so a different photo of the same product never replaces one an older item links to
+    return f"cache-image/{content_hash[:16]}.{extension}"
+
+async def upload_image_async(bot, photo):
+    # Returns (image_url, byte length, mime type) for the feed enclosure, or None
+    try:
+        content = await _load_image(bot, photo)
+    except Exception as e:
+        logger.error("Failed to download image %s: %s", photo, e)
+        return None
+    if content is None:
+        return None
+    content_hash = hashlib.sha256(content).hexdigest()
+
+    # The same photo forwarded again is already on GitHub; reuse its URL
+    uploaded = uploaded_images.get(content_hash)
+    if uploaded:
+        increment('image_dedupe_hits')
+        logger.info("Image %s already uploaded as %s", photo, uploaded[0])
+        return tuple(uploaded)
+
+    processed = await process_image_async(content)
+    if processed is None:
+        return None
+    processed, mime_type, extension = processed
+    path = image_path(content_hash, extension)
+    uploaded = (github_sync.raw_url(path), len(processed), mime_type)
+    # Remembered only once the push succeeds, so a failed push never leaves a dead URL in the index
+    await github_sync.schedule(path, processed, on_pushed=lambda: uploaded_images.set(content_hash, list(uploaded)))
+    return uploaded
+
+def feed_entry(content, title=None, description=None, image=None, published=None):
+    image_url, image_length, image_type = image if image else (None, 0, None)
+    return {
+        'content': content,
+        'title': title,
+        'description': description,
+        'image_url': image_url,
+        'image_length': image_length,
+        'image_type': image_type,
+        'published': published,
+    }
+
+async def publish_feed_entries_async(entries):
+    rss_feed_content = await run_blocking(add_entries_to_rss_feed, entries)
+    if rss_feed_content is not None:
+        # Rendered again when the push fires, from the store every worker appends to,
+        # so a push delayed by the debounce never sends an older feed than another's
+        await github_sync.schedule(RSS_FEED_PATH, write_feed)
@@ -0,0 +1,57 @@
+## startup_report.py
+#
+# Cold-start check for container restarts: imports main in a fresh interpreter
+# with -X importtime, lists the slowest imports and fails if the total goes
+# over STARTUP_TARGET_SECONDS.
+#   python startup_report.py [--top 15]
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from config import STARTUP_TARGET_SECONDS
+
+def measure_imports(module='main'):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+        # importtime indents nested imports by two spaces per level
+        imports.append((int(cumulative_us), int(self_us), name[1:].rstrip()))
+    return elapsed, imports
+
+def main():
+    parser = argparse.ArgumentParser(description='Import-time report for the bot')
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--module', default='main')
+    args = parser.parse_args()
+
+    elapsed, imports = measure_imports(args.module)
+    top_level = [entry for entry in imports if not entry[2].startswith(' ')]
+    import_total = sum(cumulative for cumulative, _, _ in top_level) / 1e6
+
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for cumulative, self_us, name in sorted(imports, reverse=True)[:args.top]:
+        print(f"{cumulative / 1000:>10.1f}ms {self_us / 1000:>8.1f}ms  {name}")
+    print(f"\nimports: {import_total:.3f}s, interpreter start to exit: {elapsed:.3f}s, target: {STARTUP_TARGET_SECONDS:.3f}s")
+
+    for heavy in ('feedgen', 'aliexpress_api', 'PIL'):
+        if any(name.strip() == heavy for _, _, name in imports):
+            print(f"warning: {heavy} is imported at startup")
+
+    if elapsed > STARTUP_TARGET_SECONDS:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
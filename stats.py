@@ -0,0 +1,90 @@
+## stats.py
+
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metrics import snapshot, render_prometheus
+from cache import cache_stats
+from send_queue import rate_limiter
+from github_sync import github_sync
+from services import product_batcher
+from draft_store import drafts
+from publish_queue import publish_queue
+from config import METRICS_HOST
+
+logger = logging.getLogger(__name__)
+
+def collect_stats():
+    stats = snapshot()
+    stats['caches'] = cache_stats()
+    stats['send_queue'] = rate_limiter.stats()
+    stats['github'] = github_sync.stats()
+    stats['product_batcher'] = product_batcher.stats()
+    stats['drafts'] = len(drafts)
+    if publish_queue is not None:
+        stats['publish_queue'] = len(publish_queue)
+        stats['publish_failed'] = publish_queue.failed_count()
+    return stats
+
+def _numeric_gauges(stats, prefix=''):
+    gauges = {}
+    for key, value in stats.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            gauges.update(_numeric_gauges(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            gauges[name] = value
+    return gauges
+
+def prometheus_text():
+    stats = collect_stats()
+    # Latencies, API calls and counters get their own metric families
+    extra = {key: value for key, value in stats.items() if key not in ('stages', 'api_calls', 'counters')}
+    return render_prometheus(_numeric_gauges(extra))
+
+def format_stats(stats):
+    lines = ['Stage latency (count / avg / p50 / p99 ms):']
+    for stage, values in stats['stages'].items():
+        lines.append(f"  {stage}: {values['count']} / {values['avg_ms']} / {values['p50_ms']:g} / {values['p99_ms']:g}")
+    if not stats['stages']:
+        lines.append('  no samples yet')
+
+    lines.append('API calls: ' + (', '.join(f"{name}={count}" for name, count in sorted(stats['api_calls'].items())) or 'none'))
+    if stats['counters']:
+        lines.append('Counters: ' + ', '.join(f"{name}={count}" for name, count in sorted(stats['counters'].items())))
+
+    lines.append('Caches:')
+    for name, values in stats['caches'].items():
+        lines.append(f"  {name}: {values['hits']} hits, {values['misses']} misses ({values['hit_ratio']:.0%}), {values['size']} entries")
+
+    send_queue = stats['send_queue']
+    lines.append(f"Send queue: {send_queue['queue_depth']} waiting, {send_queue['sent']} sent, {send_queue['retried']} retried, {send_queue['flood_waits']} flood waits")
+    github = stats['github']
+    lines.append(f"GitHub: {github['commits_pushed']} commits, {github['files_pushed']} files, {github['pending_files']} pending, {github['conflicts']} conflicts, {github['failed_pushes']} failed pushes")
+    batcher = stats['product_batcher']
+    lines.append(f"Product batches: {batcher['batches_sent']} sent for {batcher['ids_requested']} IDs, {batcher['pending']} pending")
+    lines.append(f"Open drafts: {stats['drafts']}")
+    if 'publish_queue' in stats:
+        lines.append(f"Publish queue: {stats['publish_queue']} waiting, {stats['publish_failed']} taken off after failing")
+    return '\n'.join(lines)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port, host=METRICS_HOST):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info("Serving Prometheus metrics on %s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,104 @@
+## test_forwarded_message.py
+#
+# Drives process_forwarded_message against the benchmark's AliExpress and
+# short-link stand-ins and checks how many external API calls one message costs.
+#   python -m pytest test_forwarded_message.py
+
+import itertools
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+# Config is read at import, so the environment comes first
+os.environ.update({
+    'TELEGRAM_API_TOKEN': '123456:test',
+    'CACHE_DIR': tempfile.mkdtemp(prefix='promo-test-'),
+    'DRAFT_STORE_BACKEND': 'memory',
+    'PUBLISH_SLOT_MINUTES': '0',
+})
+
+import clients
+from benchmark import FakeAliexpressApi, FakeServices
+from draft_store import drafts
+from handlers import process_forwarded_message
+from metrics import track_api_calls
+
+_ids = itertools.count(1)
+
+class FakeMessage:
+    def __init__(self, content, photo=None, chat_id=4242):
+        self.message_id = next(_ids)
+        self.chat_id = chat_id
+        self.content = content
+        self.photo = [SimpleNamespace(file_id=photo)] if photo else []
+        self.replies = []
+
+    async def reply_text(self, text, reply_markup=None):
+        return self._reply(text, reply_markup)
+
+    async def reply_photo(self, photo, caption=None, reply_markup=None):
+        return self._reply(caption, reply_markup)
+
+    def _reply(self, text, reply_markup):
+        self.replies.append((text, reply_markup))
+        return SimpleNamespace(message_id=next(_ids))
+
+def item_url(product_id):
+    return f"https://www.aliexpress.com/item/{product_id}.html"
+
+class ForwardedMessageApiCallsTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.services = FakeServices(0, 0, 0)
+        cls.services.start()
+        clients._aliexpress = FakeAliexpressApi(0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.services.stop()
+
+    async def forward(self, message):
+        with track_api_calls() as api_calls:
+            await process_forwarded_message(message, message.content)
+        return dict(api_calls)
+
+    async def test_every_link_is_converted_in_one_call(self):
+        message = FakeMessage(f"Earbuds for $9.99 (-50%) {item_url(1005001000000001)}?spm=a2g0o.deal\n"
+                              f"Case: {item_url(1005001000000002)}\nSee also https://example.com/reviews")
+        api_calls = await self.forward(message)
+
+        self.assertEqual(api_calls, {'get_affiliate_links': 1, 'get_products_details': 1})
+        draft = drafts.get(message.chat_id, message.message_id)
+        self.assertIsNotNone(draft)
+        self.assertEqual(draft.product_id, '1005001000000001')
+        self.assertEqual(draft.converted.count('s.click.aliexpress.com'), 2)
+        self.assertEqual([text for text, _ in message.replies], [draft.converted])
+
+    async def test_photo_caption_reuses_the_conversion(self):
+        message = FakeMessage(f"Smart watch deal, only today {item_url(1005001000000003)}", photo='AgACAgQAAxkBAAITest')
+        api_calls = await self.forward(message)
+
+        self.assertEqual(api_calls, {'get_affiliate_links': 1, 'get_products_details': 1})
+        draft = drafts.get(message.chat_id, message.message_id)
+        self.assertEqual(draft.photo, 'AgACAgQAAxkBAAITest')
+        self.assertEqual(message.replies[0][0], draft.converted)
+
+    async def test_short_link_is_resolved_once(self):
+        message = FakeMessage(f"Power bank 20000mAh lowest price {self.services.url}/e/_1005001000000004")
+        api_calls = await self.forward(message)
+
+        self.assertEqual(api_calls, {'resolve_shortened_url': 1, 'get_affiliate_links': 1, 'get_products_details': 1})
+        self.assertEqual(drafts.get(message.chat_id, message.message_id).product_id, '1005001000000004')
+
+    async def test_duplicate_is_skipped_before_any_call(self):
+        content = f"Mechanical keyboard with hot-swap switches {item_url(1005001000000005)}"
+        await self.forward(FakeMessage(content))
+        duplicate = FakeMessage(content)
+        api_calls = await self.forward(duplicate)
+
+        self.assertEqual(api_calls, {})
+        self.assertIsNone(drafts.get(duplicate.chat_id, duplicate.message_id))
+
+if __name__ == "__main__":
+    unittest.main()
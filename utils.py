@@ -1,72 +1,92 @@
 ## utils.py
 
+import asyncio
+import io
 import os
-import base64
+import time
 import logging
-import requests
-from config import GIT_TOKEN, GITHUB_REPOSITORY, RSS_FEED_PATH, CACHE_DIR
+from telegram.error import BadRequest
+from config import CACHE_DIR, CACHE_FILE_MAX_AGE, HTTP_TIMEOUT, DELETE_CONCURRENCY, DEFER_CLEANUP
+from clients import get_http_session
+from metrics import increment
 
 logger = logging.getLogger(__name__)
 
-temporary_storage = {}
+# Bot API limit for a single deleteMessages call
+BULK_DELETE_LIMIT = 100
 
-def update_github_file(content):
-    url = f"https://api.github.com/repos/{GITHUB_REPOSITORY}/contents/{RSS_FEED_PATH}"
-    headers = {
-        "Authorization": f"token {GIT_TOKEN}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+_cleanup_tasks = set()
 
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        sha = response.json()['sha']
-    else:
-        sha = None
+async def download_to_memory(bot, file_id):
+    file = await bot.get_file(file_id)
+    buffer = io.BytesIO()
+    await file.download_to_memory(out=buffer)
+    # getbuffer() exposes the downloaded bytes without another copy
+    content = buffer.getbuffer()
+    increment('image_bytes_downloaded', len(content))
+    logger.info("Photo %s downloaded to memory (%s bytes)", file_id, len(content))
+    return content
 
-    data = {
-        "message": "Update RSS feed",
-        "content": content,
-        "sha": sha
-    }
+def download_url(url):
+    # Product images picked from AliExpress are URLs rather than Telegram file IDs
+    response = get_http_session().get(url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    increment('image_bytes_downloaded', len(response.content))
+    return response.content
 
-    response = requests.put(url, json=data, headers=headers)
-    if response.status_code in [200, 201]:
-        logger.info("RSS feed updated on GitHub.")
-    else:
-        logger.error(f"Failed to update RSS feed on GitHub: {response.json()}")
+def cleanup_cache_dir(max_age=CACHE_FILE_MAX_AGE):
+    # Photos used to be downloaded to CACHE_DIR; drop any that are left over
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+    removed = 0
+    cutoff = time.time() - max_age
+    for entry in os.scandir(CACHE_DIR):
+        if entry.is_file() and entry.name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
+            if entry.stat().st_mtime < cutoff:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError as e:
+                    logger.error("Failed to remove cached file %s: %s", entry.path, e)
+    if removed:
+        logger.info("Removed %s stale files from %s", removed, CACHE_DIR)
+    return removed
 
-async def download_image(context, file_id, file_name):
-    file = await context.bot.get_file(file_id)
-    file_path = os.path.join(CACHE_DIR, file_name)
-    await file.download_to_drive(file_path)
-    logger.info(f"Photo downloaded to {file_path}")
-    return file_path
+async def delete_messages(bot, chat_id, message_ids, background=DEFER_CLEANUP):
+    message_ids = list(dict.fromkeys(message_ids))
+    if not message_ids:
+        return
+    if background:
+        # Let the caller reply right away; the deletes finish on their own
+        task = asyncio.create_task(_delete_messages(bot, chat_id, message_ids))
+        _cleanup_tasks.add(task)
+        task.add_done_callback(_cleanup_tasks.discard)
+        return
+    await _delete_messages(bot, chat_id, message_ids)
 
-def upload_to_github(file_path, file_name):
-    url = f"https://api.github.com/repos/{GITHUB_REPOSITORY}/contents/cache-image/{file_name}"
-    
-    with open(file_path, 'rb') as file:
-        content = base64.b64encode(file.read()).decode('utf-8')
-    
-    data = {
-        "message": f"Add {file_name}",
-        "committer": {
-            "name": "Your Name",
-            "email": "your-email@example.com"
-        },
-        "content": content
-    }
-    
-    headers = {
-        "Authorization": f"token {GIT_TOKEN}",
-        "Accept": "application/vnd.github.v3+json"
-    }
-    
-    response = requests.put(url, json=data, headers=headers)
-    
-    if response.status_code == 201:
-        logger.info("File uploaded to GitHub successfully")
-        return response.json()['content']['download_url']
-    else:
-        logger.error(f"Failed to upload file to GitHub: {response.status_code}, {response.json()}")
-        return None
+async def _delete_messages(bot, chat_id, message_ids):
+    if hasattr(bot, 'delete_messages'):
+        try:
+            # deleteMessages silently skips messages that are already gone
+            for start in range(0, len(message_ids), BULK_DELETE_LIMIT):
+                await bot.delete_messages(chat_id=chat_id, message_ids=message_ids[start:start + BULK_DELETE_LIMIT])
+            logger.info("Deleted %s messages in chat %s", len(message_ids), chat_id)
+            return
+        except Exception as e:
+            logger.warning("Bulk delete failed in chat %s, deleting one by one: %s", chat_id, e)
+
+    semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+    async def delete_one(msg_id):
+        async with semaphore:
+            try:
+                await bot.delete_message(chat_id=chat_id, message_id=msg_id)
+            except BadRequest as e:
+                if 'not found' in str(e).lower():
+                    logger.debug("Message %s was already deleted", msg_id)
+                else:
+                    logger.error("Failed to delete message %s: %s", msg_id, e)
+            except Exception as e:
+                logger.error("Failed to delete message %s: %s", msg_id, e)
+
+    await asyncio.gather(*(delete_one(msg_id) for msg_id in message_ids))
@@ -0,0 +1,173 @@
+## webhook_dispatcher.py
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from logging_setup import setup_logging
+from config import (TELEGRAM_API_TOKEN, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+                    WEBHOOK_SECRET, DRAFT_STORE_BACKEND, CONCURRENT_UPDATES, HTTP_TIMEOUT,
+                    TELEGRAM_API_BASE_URL, METRICS_PORT)
+
+logger = logging.getLogger(__name__)
+
+def update_chat_id(update):
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if key in update:
+            return update[key]['chat']['id']
+    callback_query = update.get('callback_query')
+    if callback_query:
+        message = callback_query.get('message')
+        return message['chat']['id'] if message else callback_query['from']['id']
+    return update.get('update_id', 0)
+
+def worker_index(chat_id, workers):
+    # Sticky routing: one chat always lands on the same worker, which keeps its
+    # updates in order and its user_data (e.g. the draft being edited) local
+    return zlib.crc32(str(chat_id).encode('ascii')) % workers
+
+def _worker_main(index, queue, processed):
+    setup_logging(fmt=f'%(asctime)s - worker-{index} - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_run_worker(index, queue, processed))
+
+async def _run_worker(index, queue, processed):
+    from telegram import Update
+    from main import build_application, start_background_tasks
+    from github_sync import github_sync
+
+    application = build_application(updater=False)
+    semaphore = asyncio.Semaphore(CONCURRENT_UPDATES)
+    tasks = set()
+    loop = asyncio.get_running_loop()
+
+    async def process(update):
+        try:
+            await application.process_update(update)
+        finally:
+            semaphore.release()
+            with processed.get_lock():
+                processed[index] += 1
+
+    async with application:
+        await application.start()
+        # Each worker keeps its own metrics, so each gets its own port
+        start_background_tasks(application, METRICS_PORT + index if METRICS_PORT > 0 else 0)
+        logger.info("Worker %s ready", index)
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            await semaphore.acquire()
+            update = Update.de_json(json.loads(data), application.bot)
+            task = asyncio.create_task(process(update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await application.stop()
+        await github_sync.flush()
+
+class Dispatcher:
+    def __init__(self, workers):
+        context = multiprocessing.get_context('spawn')
+        self.workers = workers
+        self.queues = [context.Queue() for _ in range(workers)]
+        self.received = context.Value('Q', 0)
+        self.processed = context.Array('Q', workers)
+        self.processes = [
+            context.Process(target=_worker_main, args=(index, queue, self.processed), name=f'promo-worker-{index}')
+            for index, queue in enumerate(self.queues)
+        ]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def dispatch(self, body):
+        update = json.loads(body)
+        index = worker_index(update_chat_id(update), self.workers)
+        self.queues[index].put(body)
+        with self.received.get_lock():
+            self.received.value += 1
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'received': self.received.value,
+            'processed': list(self.processed),
+            'queue_depth': [queue.qsize() for queue in self.queues],
+        }
+
+    def stop(self):
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join()
+
+def _make_request_handler(dispatcher):
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != WEBHOOK_PATH:
+                self.send_error(404)
+                return
+            if WEBHOOK_SECRET and self.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+                self.send_error(403)
+                return
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                dispatcher.dispatch(body)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error("Rejected malformed update: %s", e)
+                self.send_error(400)
+                return
+            self.send_response(200)
+            self.end_headers()
+
+        def do_GET(self):
+            if self.path != '/stats':
+                self.send_error(404)
+                return
+            body = json.dumps(dispatcher.stats()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return WebhookHandler
+
+def set_webhook():
+    response = requests.post(
+        f"{TELEGRAM_API_BASE_URL or 'https://api.telegram.org/bot'}{TELEGRAM_API_TOKEN}/setWebhook",
+        json={"url": WEBHOOK_URL, "secret_token": WEBHOOK_SECRET} if WEBHOOK_SECRET else {"url": WEBHOOK_URL},
+        timeout=HTTP_TIMEOUT
+    )
+    if response.ok:
+        logger.info("Webhook set to %s", WEBHOOK_URL)
+    else:
+        logger.error("Failed to set webhook: %s, %s", response.status_code, response.text)
+
+def run_dispatcher(workers):
+    if workers > 1 and DRAFT_STORE_BACKEND != 'sqlite':
+        raise SystemExit("Webhook mode with several workers needs DRAFT_STORE_BACKEND=sqlite so drafts are shared")
+
+    dispatcher = Dispatcher(workers)
+    dispatcher.start()
+    if WEBHOOK_URL:
+        set_webhook()
+
+    server = ThreadingHTTPServer((WEBHOOK_LISTEN, WEBHOOK_PORT), _make_request_handler(dispatcher))
+    logger.info("Dispatching webhook updates on %s:%s%s to %s workers", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        dispatcher.stop()